@@ -18,13 +18,15 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
-import time
 
 import Adafruit_GPIO as GPIO
 import Adafruit_GPIO.I2C as I2C
 import Adafruit_GPIO.MCP230xx as MCP
 import Adafruit_GPIO.PWM as PWM
 
+from .lcdtiming import HybridTimer, SettleDeadline
+from .trace import tracer
+
 
 # Commands
 LCD_CLEARDISPLAY        = 0x01
@@ -98,6 +100,13 @@ LCD_BACKPACK_LITE       = 7
 class Adafruit_CharLCD(object):
     """Class to represent and interact with an HD44780 character LCD display."""
 
+    # How long the controller is busy after each byte (37us in the
+    # datasheet), and after clear/home (1.52ms in the datasheet)
+    write_settle_us = 100
+    clear_settle_us = 3000
+    # The first function set when initializing needs more than 4.1ms
+    init_settle_us = 5000
+
     def __init__(self, rs, en, d4, d5, d6, d7, cols, lines, backlight=None,
                     invert_polarity=True,
                     enable_pwm=False,
@@ -131,6 +140,9 @@ class Adafruit_CharLCD(object):
         pass in an GPIO instance, the default GPIO for the running platform will
         be used.
         """
+        # Keep track of when the controller is ready for more.
+        self._timer = HybridTimer()
+        self._settle = SettleDeadline(self._timer)
         # Save column and line state.
         self._cols = cols
         self._lines = lines
@@ -159,6 +171,7 @@ class Adafruit_CharLCD(object):
                 gpio.output(backlight, self._blpol if initial_backlight else not self._blpol)
         # Initialize the display.
         self.write8(0x33)
+        self._settle.extend(self.init_settle_us)
         self.write8(0x32)
         # Initialize display control, function, and mode registers.
         self.displaycontrol = LCD_DISPLAYON | LCD_CURSOROFF | LCD_BLINKOFF
@@ -173,12 +186,12 @@ class Adafruit_CharLCD(object):
     def home(self):
         """Move the cursor back to its home (first line and first column)."""
         self.write8(LCD_RETURNHOME)  # set cursor position to zero
-        self._delay_microseconds(3000)  # this command takes a long time!
+        self._settle.extend(self.clear_settle_us)  # this command takes a long time!
 
     def clear(self):
         """Clear the LCD."""
         self.write8(LCD_CLEARDISPLAY)  # command to clear display
-        self._delay_microseconds(3000)  # 3000 microsecond sleep, clearing the display takes a long time
+        self._settle.extend(self.clear_settle_us)  # clearing the display takes a long time
 
     def set_cursor(self, col, row):
         """Move the cursor to an explicit column and row position."""
@@ -272,8 +285,8 @@ class Adafruit_CharLCD(object):
         value from 0-255, and char_mode is True if character data or False if
         non-character data (default).
         """
-        # One millisecond delay to prevent writing too quickly.
-        self._delay_microseconds(1000)
+        if tracer.enabled:
+            tracer.instant('lcd.write8', {'value': value, 'char_mode': char_mode})
         # Set character / data bit.
         self._gpio.output(self._rs, char_mode)
         # Write upper 4 bits.
@@ -281,6 +294,9 @@ class Adafruit_CharLCD(object):
                                  self._d5: ((value >> 5) & 1) > 0,
                                  self._d6: ((value >> 6) & 1) > 0,
                                  self._d7: ((value >> 7) & 1) > 0 })
+        # Setting up the pins above overlaps with the previous command,
+        # but it has to finish before the new one is latched.
+        self._settle.wait()
         self._pulse_enable()
         # Write lower 4 bits.
         self._gpio.output_pins({ self._d4: (value        & 1) > 0,
@@ -288,6 +304,7 @@ class Adafruit_CharLCD(object):
                                  self._d6: ((value >> 2) & 1) > 0,
                                  self._d7: ((value >> 3) & 1) > 0 })
         self._pulse_enable()
+        self._settle.extend(self.write_settle_us)
 
     def create_char(self, location, pattern):
         """Fill one of the first 8 CGRAM locations with custom characters.
@@ -303,10 +320,8 @@ class Adafruit_CharLCD(object):
             self.write8(pattern[i], char_mode=True)
 
     def _delay_microseconds(self, microseconds):
-        # Busy wait in loop because delays are generally very short (few microseconds).
-        end = time.time() + (microseconds/1000000.0)
-        while time.time() < end:
-            pass
+        # Only spins for very short delays (few microseconds).
+        self._timer.delay_us(microseconds)
 
     def _pulse_enable(self):
         # Pulse the clock enable line off, on, off to send command.
@@ -315,7 +330,7 @@ class Adafruit_CharLCD(object):
         self._gpio.output(self._en, True)
         self._delay_microseconds(1)       # 1 microsecond pause - enable pulse must be > 450ns
         self._gpio.output(self._en, False)
-        self._delay_microseconds(1)       # commands need > 37us to settle
+        self._delay_microseconds(1)       # commands need > 37us to settle (see write8)
 
     def _pwm_duty_cycle(self, intensity):
         # Convert intensity value of 0.0 to 1.0 to a duty cycle of 0.0 to 100.0
@@ -0,0 +1,472 @@
+# This file is part of DragonPi.
+#
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+"""The audio engine that plays and cross-fades music with VLC.
+
+Input handlers (e.g. ``dndmusic.MusicListener``) translate key
+presses into calls on a shared ``AudioEngine``.
+
+"""
+
+import logging
+log = logging.getLogger(__name__)
+import math
+import os
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+
+import vlc
+
+from . import fades
+from .resources import ResourceLedger
+from .trace import tracer
+
+# Cross fade intervals, in second
+FADE_TIME = 1.5
+BATTLE_FADE_TIME = 0.3
+VICTORY_FADE_TIME = 0.2
+RESUME_FADE_TIME = 0.3
+OUTPUT_FADE_TIME = 0.15
+RESTORE_FADE_TIME = 3.
+
+
+def find_output_devices(listing=None):
+    """Look up the ALSA devices for the auto, analog and HDMI outputs.
+
+    The card names differ between Raspberry Pi models and OS images,
+    so they are picked out of the devices listed by ``aplay -L``. Any
+    output that can't be found keeps the default from
+    ``AudioEngine.output_devices``.
+
+    Parameters
+    ----------
+    listing : str
+      Output of ``aplay -L``; by default, ``aplay`` is run.
+
+    """
+    devices = list(AudioEngine.output_devices)
+    if listing is None:
+        try:
+            listing = subprocess.run(['aplay', '-L'], capture_output=True,
+                                     text=True, timeout=5).stdout
+        except (OSError, subprocess.SubprocessError) as e:
+            log.warning("Could not list ALSA devices: %s", e)
+            return tuple(devices)
+    # Device names start a line, and their descriptions are indented
+    names = [line for line in listing.splitlines()
+             if line.startswith('sysdefault:CARD=')]
+    for name in reversed(names):
+        card = name.partition('=')[2].lower()
+        if 'hdmi' in card or card == 'b1':
+            devices[2] = name
+        elif 'headphones' in card or card == 'alsa':
+            devices[1] = name
+    log.info("Using ALSA audio devices %s", devices)
+    return tuple(devices)
+
+
+class AudioEngine():
+    """Plays one song at a time, fading between them.
+
+    Parameters
+    ----------
+    instance
+      The VLC instance to create players with. If omitted, a new
+      ``vlc.Instance`` is created.
+    idle : idle.IdleManager
+      If given, the player is released while the music is paused and
+      the program goes idle.
+    output_devices : tuple
+      ALSA devices for the auto, analog and HDMI outputs, e.g. from
+      ``find_output_devices()``.
+
+    """
+    _player = None
+    volume = 100
+    fade_curve = 'equal-power'
+    fade_interval = fades.UPDATE_INTERVAL
+    min_volume = 0
+    max_volume = 100
+    # How long to wait for a new player to start before seeking, in seconds
+    seek_timeout = 2.
+    # How many parsed media to keep around for quick restarts
+    media_cache_size = 8
+    # Only one song plays at a time, so there should only be one player
+    max_players = 1
+    # Default ALSA devices for each audio output (auto, analog, HDMI)
+    # on recent Raspberry Pi OS images; see ``find_output_devices()``
+    output_devices = ('default', 'sysdefault:CARD=Headphones', 'sysdefault:CARD=b1')
+    output_idx = 0
+    # Where the song was at the last step, for when ``snapshot()``
+    # can't get the lock, in milliseconds
+    _position = 0
+    # How long ``snapshot()`` waits for the lock, in seconds
+    snapshot_timeout = 0.05
+    # Called with the steps of operations that the engine starts by
+    # itself, e.g. releasing the player when idle; by default they
+    # are carried out straight away with ``run()``
+    schedule = None
+
+    def __init__(self, instance=None, idle=None, output_devices=None):
+        if instance is None:
+            instance = vlc.Instance('--input-repeat=999999', '--quiet')
+        self.instance = instance
+        if output_devices is not None:
+            self.output_devices = tuple(output_devices)
+        self.song_file = None
+        self.paused = False
+        # (song_file, position) of a paused song whose player was released
+        self._released = None
+        self._media_cache = OrderedDict()
+        # Count VLC objects to catch any that don't get released
+        self.resources = ResourceLedger(limits={'player': self.max_players,
+                                                'media': self.media_cache_size})
+        self._lock = threading.RLock()
+        self.idle = idle
+        if idle is not None:
+            idle.subscribe(on_idle=self._on_idle)
+
+    def _touch(self, busy):
+        if self.idle is not None:
+            self.idle.set_busy(busy)
+
+    def get_media(self, song_file):
+        """Return a (possibly cached) VLC media for *song_file*."""
+        media = self._media_cache.pop(song_file, None)
+        if media is None:
+            # Make room for the new media first
+            while len(self._media_cache) >= self.media_cache_size:
+                old_file, old_media = self._media_cache.popitem(last=False)
+                old_media.release()
+                self.resources.release('media')
+            media = self.instance.media_new(song_file)
+            self.resources.acquire('media')
+        self._media_cache[song_file] = media
+        return media
+
+    def _new_player(self):
+        player = self.instance.media_player_new()
+        self.resources.acquire('player')
+        return player
+
+    def _release_player(self):
+        """Stop the current player and free its VLC resources."""
+        # Not while ``snapshot()`` is asking the player where it is
+        with self._lock:
+            self._position = max(self._player.get_time(), 0)
+            self._player.stop()
+            self._player.release()
+            self._player = None
+            self.resources.release('player')
+
+    def close(self):
+        """Release the player and all cached media."""
+        with self._lock:
+            if self._player is not None:
+                self._release_player()
+            while self._media_cache:
+                song_file, media = self._media_cache.popitem()
+                media.release()
+                self.resources.release('media')
+
+    def run(self, steps):
+        """Carry out an operation from one of the ``*_steps()`` methods,
+        sleeping in between the steps.
+
+        Each of the engine's operations is written as a generator
+        that yields how long to wait before its next step. This
+        blocking runner is used by the plain methods (e.g.
+        ``play_song()``), while ``runtime.AsyncRuntime`` waits on
+        the event loop instead.
+
+        """
+        with self._lock:
+            for delay in steps:
+                self.record_position()
+                time.sleep(delay)
+            self.record_position()
+
+    def record_position(self):
+        """Note where the song is, for ``snapshot()`` to report while
+        the engine is busy."""
+        with self._lock:
+            if self._player is not None:
+                self._position = max(self._player.get_time(), 0)
+            elif self._released is not None:
+                self._position = self._released[1]
+            elif self.song_file is None:
+                self._position = 0
+
+    def stop_music(self, fade_time=FADE_TIME):
+        self.run(self.stop_music_steps(fade_time=fade_time))
+
+    def stop_music_steps(self, fade_time=FADE_TIME):
+        self._released = None
+        if self._player is not None:
+            log.debug('Stopping music')
+            with tracer.span('music.stop', fade_time=fade_time):
+                yield from self.fade_volume_steps(0, fade_time=fade_time)
+                self._release_player()
+        self.song_file = None
+        self.paused = False
+        self._touch(busy=False)
+
+    def fade_volume(self, target, fade_time=FADE_TIME):
+        self.run(self.fade_volume_steps(target, fade_time=fade_time))
+
+    def fade_volume_steps(self, target, fade_time=FADE_TIME):
+        if self._player is not None:
+            start = time.perf_counter_ns()
+            init_vol = self._player.audio_get_volume()
+            plan = fades.fade_plan(init_vol, round(target), fade_time,
+                                   curve=self.fade_curve,
+                                   interval=self.fade_interval)
+            # Step through the fade
+            for volume, hold_time in plan:
+                self._player.audio_set_volume(volume)
+                yield hold_time
+            tracer.complete('music.fade', start, {'from': init_vol, 'to': target,
+                                                  'steps': len(plan)})
+            log.debug('Faded volume from %d to %d in %d steps', init_vol,
+                      round(target), len(plan))
+
+    def start_music(self, song_file, fade_time, position=None):
+        """Start playing *song_file*, fading in from silence.
+
+        Parameters
+        ----------
+        song_file : str
+          Path to the song to play.
+        fade_time : float
+          How long to fade in, in seconds.
+        position : int
+          Where to start playing, in milliseconds.
+
+        """
+        self.run(self.start_music_steps(song_file, fade_time, position=position))
+
+    def start_music_steps(self, song_file, fade_time, position=None):
+        if os.path.exists(song_file):
+            log.info("Starting song: %s", song_file)
+            with tracer.span('music.open', song=os.path.basename(song_file)):
+                if self._player is not None:
+                    # Don't leave the old player running
+                    self._release_player()
+                self._player = self._new_player()
+                self._player.set_media(self.get_media(song_file))
+                if self.output_idx != 0:
+                    self._player.audio_output_device_set(
+                        None, self.output_devices[self.output_idx])
+                self._player.audio_set_volume(0)
+                self._player.play()
+            self.song_file = song_file
+            self.paused = False
+            yield 0.01
+            if position:
+                yield from self.seek_steps(position)
+            yield from self.fade_volume_steps(self.volume, fade_time=fade_time)
+            self._touch(busy=True)
+        else:
+            log.error('Song file not found: %s', song_file)
+
+    def seek_steps(self, position):
+        """Move the player to *position* (in milliseconds) once it has
+        started, since libvlc ignores seeks until then."""
+        deadline = time.monotonic() + self.seek_timeout
+        while self._player.get_state() != vlc.State.Playing:
+            if self._player.get_state() == vlc.State.Error:
+                log.error("Could not play %s", self.song_file)
+                return
+            if time.monotonic() > deadline:
+                log.warning("Player took too long to start, seeking anyway")
+                break
+            yield 0.01
+        self._player.set_time(position)
+
+    def toggle_pause(self):
+        self.run(self.toggle_pause_steps())
+
+    def toggle_pause_steps(self):
+        if self._released is not None:
+            # Pick up where we left off before going idle
+            song_file, position = self._released
+            self._released = None
+            log.debug("Resuming released song at %d ms", position)
+            tracer.instant('music.resume', {'position': position})
+            yield from self.start_music_steps(song_file, fade_time=RESUME_FADE_TIME,
+                                              position=position)
+        elif self._player is not None:
+            self.paused = not self.paused
+            log.debug("Paused music" if self.paused else "Unpaused music")
+            tracer.instant('music.pause')
+            self._player.pause()
+            self._touch(busy=not self.paused)
+
+    def _on_idle(self):
+        steps = self.idle_release_steps()
+        if self.schedule is not None:
+            self.schedule(steps)
+        else:
+            self.run(steps)
+
+    def idle_release_steps(self):
+        # Something may have happened while waiting for a turn
+        if self.idle.is_idle:
+            yield from self.release_player_steps()
+
+    def release_player(self):
+        """Free the VLC player of a paused song, remembering where it
+        was so ``toggle_pause()`` can resume it later."""
+        self.run(self.release_player_steps())
+
+    def release_player_steps(self):
+        if self._player is None or not self.paused:
+            return
+        position = self._player.get_time()
+        self._released = (self.song_file, position)
+        log.info("Releasing idle player for %s at %d ms", self.song_file, position)
+        tracer.instant('music.release', {'position': position})
+        self._release_player()
+        yield from ()
+
+    def set_output(self, idx, fade_time=OUTPUT_FADE_TIME):
+        """Switch the audio output, e.g. between analog and HDMI.
+
+        If a song is playing, its player is faded out, moved to the
+        new device and faded back in, without re-opening the
+        song. Returns once the switch is complete, after which
+        ``output_idx`` is *idx*.
+
+        Parameters
+        ----------
+        idx : int
+          Index into ``output_devices`` for the new output.
+        fade_time : float
+          How long to fade out, and then in again, in seconds.
+
+        """
+        self.run(self.set_output_steps(idx, fade_time=fade_time))
+
+    def set_output_steps(self, idx, fade_time=OUTPUT_FADE_TIME):
+        device = self.output_devices[idx]
+        if idx == self.output_idx:
+            return
+        log.info("Switching audio output to %s", device)
+        with tracer.span('music.output', device=device):
+            if self._player is not None and not self.paused:
+                yield from self.fade_volume_steps(0, fade_time=fade_time)
+                self._player.audio_output_device_set(None, device)
+                yield from self.fade_volume_steps(self.volume, fade_time=fade_time)
+            elif self._player is not None:
+                self._player.audio_output_device_set(None, device)
+            self.output_idx = idx
+
+    def snapshot(self):
+        """Describe the current playback state as a JSON-friendly dict."""
+        # Don't let a slow fade hold up the caller, but only ask the
+        # player where it is while holding the lock, since it may be
+        # released at any time
+        if self._lock.acquire(timeout=self.snapshot_timeout):
+            try:
+                self.record_position()
+            finally:
+                self._lock.release()
+        return {
+            'song_file': self.song_file,
+            'position': self._position,
+            'volume': self.volume,
+            'paused': self.paused,
+            'output_idx': self.output_idx,
+        }
+
+    def restore(self, state, fade_time=RESTORE_FADE_TIME):
+        """Go back to a state saved by ``snapshot()``.
+
+        A song that was playing starts again where it was, fading in
+        over *fade_time* seconds. A paused song stays paused, and
+        starts when ``toggle_pause()`` is called.
+
+        """
+        self.run(self.restore_steps(state, fade_time=fade_time))
+
+    def _check_state(self, state):
+        """Drop any fields of a snapshot *state* that the engine can't
+        use, e.g. from an older version or a damaged file."""
+        checks = {
+            'song_file': lambda v: v is None or isinstance(v, str),
+            'position': lambda v: type(v) is int and v >= 0,
+            'volume': lambda v: (isinstance(v, (int, float)) and not isinstance(v, bool)
+                                 and math.isfinite(v)
+                                 and self.min_volume <= v <= self.max_volume),
+            'paused': lambda v: isinstance(v, bool),
+            'output_idx': lambda v: (type(v) is int
+                                     and 0 <= v < len(self.output_devices)),
+        }
+        valid = {}
+        for key, value in state.items():
+            if key in checks and not checks[key](value):
+                log.warning("Ignoring invalid %s in snapshot: %r", key, value)
+            else:
+                valid[key] = value
+        return valid
+
+    def restore_steps(self, state, fade_time=RESTORE_FADE_TIME):
+        state = self._check_state(state)
+        self.volume = state.get('volume', self.volume)
+        self.output_idx = state.get('output_idx', self.output_idx)
+        song_file = state.get('song_file')
+        if song_file is None:
+            return
+        position = state.get('position', 0)
+        log.info("Restoring %s at %d ms", song_file, position)
+        if state.get('paused'):
+            self.song_file = song_file
+            self.paused = True
+            self._released = (song_file, position)
+        else:
+            yield from self.start_music_steps(song_file, fade_time=fade_time,
+                                              position=position)
+
+    def play_song(self, song_file, vol, fade_time):
+        """Cross-fade from the current song to *song_file*."""
+        self.run(self.play_song_steps(song_file, vol, fade_time))
+
+    def play_song_steps(self, song_file, vol, fade_time):
+        vol_ratio = vol / 100 if vol is not None else 1
+        self.volume *= vol_ratio
+        yield from self.stop_music_steps(fade_time=fade_time)
+        yield from self.start_music_steps(song_file, fade_time=fade_time)
+
+    def change_volume(self, delta_vol):
+        self.run(self.change_volume_steps(delta_vol))
+
+    def change_volume_steps(self, delta_vol):
+        # NaN would slip through the clamping below
+        if not math.isfinite(delta_vol):
+            raise ValueError(f"Invalid volume change: {delta_vol}")
+        new_vol = self.volume + delta_vol
+        old_vol = self.volume
+        # Make sure the new volume is within 0 and 100
+        new_vol = min(new_vol, self.max_volume)
+        new_vol = max(new_vol, self.min_volume)
+        # Execute the volume change
+        if self.volume != new_vol:
+            self.volume = new_vol
+            yield from self.fade_volume_steps(self.volume, fade_time=0.05)
+            log.debug("Changed volume from %d to %d", old_vol, new_vol)
+        else:
+            log.info("Volume NOT changed from %d to %d", old_vol, new_vol)
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+# This file is part of DragonPi.
+#
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Control DragonPi over a local socket.
+
+The server listens on a Unix domain socket (and optionally on a
+localhost TCP port) for one command per line:
+
+``KEY <key>``
+  Act as if *key* was pressed on the numberpad (see
+  ``keymap.parse_key()`` for the format).
+``CUE <song_file>``
+  Cross-fade to a song in the audio directory.
+``STOP``, ``PAUSE``
+  Stop or (un)pause the music.
+``VOL <delta>``
+  Change the volume by *delta*, e.g. ``VOL -10``.
+``MAP <name>``
+  Show a map on the displays (needs the map server).
+``FOG REVEAL|HIDE <x> <y> [<radius>]``, ``FOG MOVE <dx> <dy>``, ``FOG RESET``
+  Reveal or hide a circle of fog-of-war cells, move the GM's cursor,
+  or cover up the whole map again.
+``STATUS``
+  Report the playback state as JSON.
+``PING``
+  Do nothing, for checking the connection.
+
+Each command gets one reply line, starting with ``OK`` or ``ERR``,
+once the command has been carried out. Commands that arrive together
+are handled as a batch: consecutive volume changes are merged into
+one fade, and the replies are sent back in a single write.
+A line longer than ``MAX_LINE`` bytes gets ``ERR line too long``,
+and the connection is closed.
+
+Running this module starts a client (``dragonpi-ctl``), which can
+also be used to load-test the server.
+
+"""
+
+import logging
+log = logging.getLogger(__name__)
+import argparse
+import asyncio
+import json
+import math
+import os
+import stat
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from .keymap import parse_key, KeymapError
+
+RUNTIME_DIR = os.environ.get('XDG_RUNTIME_DIR', '/tmp')
+SOCKET_FILE = os.path.join(RUNTIME_DIR, f'dragonpi-{os.getuid()}.sock')
+# Longest command line accepted, in bytes
+MAX_LINE = 4096
+
+
+def parse_volume(arg):
+    """Parse the volume change for a VOL command."""
+    delta = float(arg)
+    if not math.isfinite(delta):
+        raise ValueError(f"Invalid volume: {arg}")
+    return delta
+
+
+class ControlServer():
+    """Serve control commands by feeding them to a music listener's
+    dispatch path.
+
+    Parameters
+    ----------
+    listener : dndmusic.MusicListener
+      Provides the key assignments and audio engine.
+    run_steps
+      Coroutine function that carries out the steps of an engine
+      operation. Operations must be run in the order this is called.
+
+    """
+    def __init__(self, listener, run_steps):
+        self.listener = listener
+        self.run_steps = run_steps
+        self._servers = []
+        self._tasks = set()
+        # Map and fog commands are carried out in order on their own thread
+        self._fog_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fog')
+
+    def parse(self, line):
+        """Parse one command line into ``(command, argument)``."""
+        command, _, arg = line.strip().partition(' ')
+        return command.upper(), arg.strip()
+
+    def steps_for(self, command, arg):
+        """Turn a command into engine steps, or None if there is
+        nothing for the engine to do."""
+        listener = self.listener
+        if command == 'KEY':
+            key = parse_key(arg)
+            if not listener.is_assigned(key):
+                raise ValueError(f"Key not assigned: {arg}")
+            steps = listener.key_steps(key)
+        elif command == 'CUE':
+            if arg in ('', '.', '..') or os.path.basename(arg) != arg:
+                raise ValueError(f"Invalid song: {arg}")
+            steps = listener.compile_action(arg, None, None)()
+        elif command == 'STOP':
+            steps = listener.compile_action('Stop', None, None)()
+        elif command == 'PAUSE':
+            steps = listener.compile_action('Pause', None, None)()
+        elif command == 'VOL':
+            steps = listener.engine.change_volume_steps(parse_volume(arg))
+        else:
+            raise ValueError(f"Unknown command: {command}")
+        return steps
+
+    def fog_call(self, command, arg):
+        """Turn a MAP or FOG command into a coroutine that carries it
+        out."""
+        fog = self.listener.fog
+        if fog is None:
+            raise ValueError("Maps are not being served")
+        if command == 'MAP':
+            # Check the map exists before going any further
+            fog.library.image_file(arg)
+            return self._call_fog(fog.show, arg)
+        op, *params = arg.split() or ['']
+        op = op.upper()
+        if op in ('REVEAL', 'HIDE'):
+            x, y, *radius = [int(p) for p in params]
+            if radius and radius[0] < 0:
+                raise ValueError(f"Invalid radius: {radius[0]}")
+            if radius and fog.active_map is not None:
+                mask = fog.mask(fog.active_map)
+                if radius[0] > max(mask.width, mask.height):
+                    raise ValueError(f"Radius is larger than the map: {radius[0]}")
+            return self._call_fog(fog.update, x, y, *radius[:1],
+                                  revealed=(op == 'REVEAL'))
+        elif op == 'MOVE':
+            dx, dy = [int(p) for p in params]
+            return self._call_fog(fog.move_cursor, dx, dy)
+        elif op == 'RESET':
+            return self._call_fog(fog.reset)
+        raise ValueError(f"Unknown fog operation: {op}")
+
+    async def _call_fog(self, func, *args, **kwargs):
+        # Showing a new map may mean slicing it into tiles first, so
+        # keep it off the event loop, and away from the audio engine
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._fog_executor, partial(func, *args, **kwargs))
+
+    async def _run(self, operation):
+        """Wait for a command's *operation* (a coroutine) to finish, and
+        return the reply for the command."""
+        try:
+            await operation
+        except Exception as e:
+            log.exception("Control command failed")
+            return f'ERR {e}\n'.encode('utf8')
+        return b'OK\n'
+
+    def _schedule(self, operation):
+        task = asyncio.create_task(self._run(operation))
+        # Keep a reference, in case the client goes away before it's done
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def handle_batch(self, lines):
+        """Handle a batch of command lines, and return the replies."""
+        # Replies, or tasks that will give the reply when they finish
+        replies = []
+        pending_vol = 0
+        pending_replies = 0
+        def flush_volume():
+            nonlocal pending_vol, pending_replies
+            if pending_replies:
+                steps = self.listener.engine.change_volume_steps(pending_vol)
+                task = self._schedule(self.run_steps(steps))
+                replies.extend([task] * pending_replies)
+            pending_vol = 0
+            pending_replies = 0
+        for line in lines:
+            command, arg = self.parse(line.decode('utf8', errors='replace'))
+            if command == '':
+                continue
+            try:
+                if command == 'VOL':
+                    # Merge consecutive volume changes into one fade
+                    pending_vol += parse_volume(arg)
+                    pending_replies += 1
+                    continue
+                flush_volume()
+                if command == 'PING':
+                    replies.append(b'OK\n')
+                elif command == 'STATUS':
+                    status = json.dumps(self.listener.engine.snapshot())
+                    replies.append(f'OK {status}\n'.encode('utf8'))
+                elif command in ('MAP', 'FOG'):
+                    replies.append(self._schedule(self.fog_call(command, arg)))
+                else:
+                    steps = self.steps_for(command, arg)
+                    if steps is None:
+                        # Already done, e.g. a fog-of-war key
+                        replies.append(b'OK\n')
+                    else:
+                        replies.append(self._schedule(self.run_steps(steps)))
+            except (ValueError, KeymapError) as e:
+                replies.append(f'ERR {e}\n'.encode('utf8'))
+        flush_volume()
+        return [reply if isinstance(reply, bytes) else await reply
+                for reply in replies]
+
+    async def handle_client(self, reader, writer):
+        buf = b''
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                buf += data
+                # Everything up to the last newline is a batch of commands
+                *lines, buf = buf.split(b'\n')
+                too_long = [i for i, line in enumerate(lines + [buf])
+                            if len(line) > MAX_LINE]
+                if too_long:
+                    # Answer the commands before it, then give up on the client
+                    lines = lines[:too_long[0]]
+                replies = await self.handle_batch(lines) if lines else []
+                if too_long:
+                    replies.append(b'ERR line too long\n')
+                if replies:
+                    writer.write(b''.join(replies))
+                    await writer.drain()
+                if too_long:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, socket_file=SOCKET_FILE, port=None):
+        """Start listening on *socket_file*, and localhost:*port* if given."""
+        if socket_file is not None:
+            try:
+                is_socket = stat.S_ISSOCK(os.stat(socket_file).st_mode)
+            except FileNotFoundError:
+                pass
+            else:
+                if not is_socket:
+                    raise FileExistsError(f"{socket_file} exists and is not a socket")
+                # Left over from a previous run
+                os.remove(socket_file)
+            server = await asyncio.start_unix_server(self.handle_client, path=socket_file)
+            os.chmod(socket_file, 0o600)
+            self._servers.append(server)
+            log.info("Control server listening on %s", socket_file)
+        if port is not None:
+            server = await asyncio.start_server(self.handle_client, '127.0.0.1', port)
+            self._servers.append(server)
+            log.info("Control server listening on localhost:%d", port)
+
+    async def close(self):
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers = []
+
+    def run_in_thread(self, socket_file=SOCKET_FILE, port=None):
+        """Run the server on its own event loop in a daemon thread.
+
+        For use with the threaded runtime, where ``run_steps`` should
+        hand the steps to ``blocking_runner()``.
+
+        """
+        def run():
+            loop = asyncio.new_event_loop()
+            loop.run_until_complete(self.start(socket_file=socket_file, port=port))
+            loop.run_forever()
+        thread = threading.Thread(target=run, name='ControlServer', daemon=True)
+        thread.start()
+        return thread
+
+
+def blocking_runner(engine):
+    """Create a ``run_steps`` coroutine function that runs engine
+    operations, in order, on a worker thread."""
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='control')
+    async def run_steps(steps):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(executor, engine.run, steps)
+    return run_steps
+
+
+async def open_connection(socket_file=SOCKET_FILE, port=None):
+    if port is not None:
+        return await asyncio.open_connection('127.0.0.1', port)
+    return await asyncio.open_unix_connection(socket_file)
+
+
+async def send_commands(commands, socket_file=SOCKET_FILE, port=None):
+    """Send some commands and return the replies."""
+    reader, writer = await open_connection(socket_file, port)
+    writer.write(''.join(f'{c}\n' for c in commands).encode('utf8'))
+    await writer.drain()
+    replies = [(await reader.readline()).decode('utf8').rstrip('\n')
+               for c in commands]
+    writer.close()
+    return replies
+
+
+async def load_test(command, count, pipeline, socket_file=SOCKET_FILE, port=None):
+    """Send *command* *count* times, *pipeline* at a time.
+
+    Returns
+    -------
+    elapsed : float
+      Total time taken, in seconds.
+    round_trips : list
+      Time, in seconds, from sending each batch to getting all its
+      replies.
+
+    """
+    reader, writer = await open_connection(socket_file, port)
+    batch = f'{command}\n'.encode('utf8') * pipeline
+    round_trips = []
+    start = time.perf_counter()
+    for i in range(0, count, pipeline):
+        t0 = time.perf_counter()
+        writer.write(batch)
+        await writer.drain()
+        for j in range(pipeline):
+            reply = await reader.readline()
+            if not reply.startswith(b'OK'):
+                raise RuntimeError(f"Server replied: {reply!r}")
+        round_trips.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    writer.close()
+    return elapsed, round_trips
+
+
+def parse_args():
+    """Parse the command-line arguments and return the options."""
+    parser = argparse.ArgumentParser(description="Send commands to a running DragonPi.")
+    parser.add_argument('commands', nargs='*', default=['STATUS'],
+                        help="Commands to send, e.g. 'KEY 1' or 'VOL -10'")
+    parser.add_argument('-s', '--socket', default=SOCKET_FILE, help="Control socket")
+    parser.add_argument('-p', '--port', type=int, help="Use localhost TCP instead")
+    parser.add_argument('-b', '--bench', type=int, metavar='N',
+                        help="Load-test the server by sending the (first) command N times")
+    parser.add_argument('--pipeline', type=int, default=1,
+                        help="Commands per batch when load-testing")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.bench:
+        elapsed, round_trips = asyncio.run(load_test(
+            args.commands[0], args.bench, args.pipeline,
+            socket_file=args.socket, port=args.port))
+        ms = sorted(rt * 1000 for rt in round_trips)
+        sent = len(round_trips) * args.pipeline
+        print(f"{sent} commands in {elapsed:.3f} s ({sent / elapsed:.0f} commands/s)")
+        print(f"Round trip per batch of {args.pipeline}: "
+              f"median {statistics.median(ms):.3f} ms, "
+              f"p95 {ms[min(len(ms) - 1, int(0.95 * len(ms)))]:.3f} ms, "
+              f"max {ms[-1]:.3f} ms")
+    else:
+        replies = asyncio.run(send_commands(args.commands, socket_file=args.socket,
+                                            port=args.port))
+        for reply in replies:
+            print(reply)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# This file is part of DragonPi.
+#
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Show the same content on several character LCDs.
+
+The menu builds one ``Frame`` per refresh, which says what to show
+but not how big the screen is. Each attached display has its own
+``DisplayWriter`` that lays the frame out for its size, compares it
+with what is already on the screen, and only rewrites the characters
+that changed.
+
+"""
+
+import logging
+log = logging.getLogger(__name__)
+import re
+from collections import namedtuple
+
+# Characters that can be left alone between two changes, rather than
+# moving the cursor (which costs as much as writing a character)
+MAX_GAP = 1
+
+display_re = re.compile(r'^(plate|backpack)(?:@(0x[0-9a-fA-F]+|\d+))?(?::(\d+)x(\d+))?$')
+
+
+Frame = namedtuple('Frame', ('title', 'text', 'status', 'color'))
+Frame.__doc__ = """What a display should show.
+
+Parameters
+----------
+title : str
+  First line, e.g. the name of the menu item.
+text : str
+  Second line, e.g. the item's current option.
+status : tuple
+  Extra lines for displays with room to spare.
+color : tuple
+  RGB backlight color, from 0 to 1.
+
+"""
+
+
+class DisplayWriter():
+    """Keeps one LCD showing the latest frame.
+
+    Parameters
+    ----------
+    lcd
+      The display, like ``Adafruit_CharLCD.Adafruit_CharLCDPlate``.
+    cols, lines : int
+      Size of the display, in characters.
+
+    """
+    def __init__(self, lcd, cols=16, lines=2):
+        self.lcd = lcd
+        self.cols = cols
+        self.lines = lines
+        self.rows = None
+        self.color = None
+
+    def layout(self, frame):
+        """Fit *frame* onto this display, one string per line."""
+        lines = [frame.title, frame.text, *frame.status][:self.lines]
+        lines += [''] * (self.lines - len(lines))
+        return [line[:self.cols].ljust(self.cols) for line in lines]
+
+    def show(self, frame):
+        """Update the display to show *frame*.
+
+        Returns
+        -------
+        int
+          How many characters were written.
+
+        """
+        rows = self.layout(frame)
+        self.set_color(frame.color)
+        if self.rows is None:
+            # Nothing is known about the screen yet, so start afresh
+            self.lcd.clear()
+            text = '\n'.join(row.rstrip() for row in rows).rstrip('\n')
+            self.lcd.message(text)
+            self.rows = rows
+            return len(text)
+        written = 0
+        for row, (old, new) in enumerate(zip(self.rows, rows)):
+            for start, end in self.changes(old, new):
+                self.lcd.set_cursor(start, row)
+                self.lcd.message(new[start:end])
+                written += end - start
+        self.rows = rows
+        return written
+
+    def set_color(self, color):
+        """Change the backlight to the RGB *color*, if it can be."""
+        if color != self.color and hasattr(self.lcd, 'set_color'):
+            self.lcd.set_color(*color)
+            self.color = color
+
+    def changes(self, old, new):
+        """Find the ``(start, end)`` spans where *new* differs from *old*."""
+        spans = []
+        for col, (a, b) in enumerate(zip(old, new)):
+            if a == b:
+                continue
+            if spans and col - spans[-1][1] <= MAX_GAP:
+                spans[-1][1] = col + 1
+            else:
+                spans.append([col, col + 1])
+        return [tuple(span) for span in spans]
+
+    def invalidate(self):
+        """Forget what is on the screen, e.g. after it was reset."""
+        self.rows = None
+        self.color = None
+
+
+def open_display(spec):
+    """Connect to an extra display and create a writer for it.
+
+    Parameters
+    ----------
+    spec : str
+      ``plate`` or ``backpack``, then optionally an I2C address and
+      size, e.g. ``backpack@0x21:20x4``.
+
+    """
+    match = display_re.match(spec)
+    if match is None:
+        raise ValueError(f"Invalid display: {spec}. Expected e.g. backpack@0x21:20x4")
+    kind, address, cols, lines = match.groups()
+    cols = int(cols) if cols is not None else 16
+    lines = int(lines) if lines is not None else 2
+    kwargs = dict(cols=cols, lines=lines)
+    if address is not None:
+        kwargs['address'] = int(address, 0)
+    from . import Adafruit_CharLCD
+    if kind == 'plate':
+        lcd = Adafruit_CharLCD.Adafruit_CharLCDPlate(**kwargs)
+    else:
+        lcd = Adafruit_CharLCD.Adafruit_CharLCDBackpack(**kwargs)
+    return DisplayWriter(lcd, cols=cols, lines=lines)
@@ -19,19 +19,19 @@ key-presses."""
 import logging
 log = logging.getLogger(__name__)
 import os
-import time
+from functools import partial
 
 from pynput import keyboard
-import vlc
+
+from .audio import AudioEngine, FADE_TIME, BATTLE_FADE_TIME, VICTORY_FADE_TIME
+from .keymap import load_keymap, KeymapWatcher
+from .maps.fog import FOG_ACTIONS
+from .maps.tiles import MapError
+from .trace import tracer
 
 THIS_DIR = os.path.abspath(os.path.dirname(__file__))
 MUSIC_DIR = os.path.join(THIS_DIR, 'audio/')
 
-# Cross fade intervals, in second
-FADE_TIME = 1.5
-BATTLE_FADE_TIME = 0.3
-VICTORY_FADE_TIME = 0.2
-
 key_from_char = keyboard.KeyCode.from_char
 key_from_vk = keyboard.KeyCode.from_vk
 
@@ -61,86 +61,135 @@ class MusicListener(keyboard.Listener):
         key_from_char('0'): ('victory_fanfare.m4a', 100, VICTORY_FADE_TIME),
         # key_from_char('/'): (None, None, None),
     }
-    _player = None
-    volume = 100
-    fade_steps = 30
-    min_volume = 0
-    max_volume = 100
+    _dispatch = {}
+    recorder = None
+    fog = None
     
-    def __init__(self, *args, **kwargs):
-        self.instance = vlc.Instance('--input-repeat=999999', '--quiet')
+    def __init__(self, *args, keymap=None, engine=None, instance=None,
+                 recorder=None, fog=None, **kwargs):
+        if engine is None:
+            engine = AudioEngine(instance=instance)
+        self.engine = engine
+        self.recorder = recorder
+        self.fog = fog
+        # Build the dispatch table for key presses
+        self._keymap_watcher = None
+        if keymap is not None:
+            self.set_key_assignments(load_keymap(keymap))
+            self._keymap_watcher = KeymapWatcher(
+                keymap, callback=self.set_key_assignments)
+        else:
+            self.set_key_assignments(self.key_assignments)
         # Setup the keyboard listener
         super().__init__(on_press=self.on_press, *args, **kwargs)
-   
-    def stop_music(self, fade_time=FADE_TIME):
-        if self._player is not None:
-            log.debug('Stopping music')
-            self.fade_volume(0, fade_time=fade_time)
-            self._player.stop()
-            # Remove the VLC media player
-            del self._player
-            self._player = None
     
-    def fade_volume(self, target, fade_time=FADE_TIME):
-        if self._player is not None:
-            init_vol = self._player.audio_get_volume()
-            curr_vol = init_vol
-            delta_vol = target - init_vol
-            # Fade in the volume
-            for i in range(self.fade_steps):
-                curr_vol = curr_vol + delta_vol/self.fade_steps
-                log.debug("Volume set to %d", round(curr_vol))
-                self._player.audio_set_volume(round(curr_vol))
-                time.sleep(fade_time / self.fade_steps)
-            log.debug('Faded volume from %d to %d', init_vol, round(curr_vol))
+    def start(self):
+        if self._keymap_watcher is not None:
+            self._keymap_watcher.start()
+        return super().start()
     
-    def start_music(self, song_file, fade_time):
-        if os.path.exists(song_file):
-            log.info("Starting song: %s", song_file)
-            self._player = self.instance.media_player_new(f'file://{song_file}')
-            self._player.audio_set_volume(0)
-            self._player.play()
-            time.sleep(0.01)
-            self.fade_volume(self.volume, fade_time=fade_time)
-        else:
-            log.error('Song file not found: %s', song_file)
+    def stop(self):
+        if self._keymap_watcher is not None:
+            self._keymap_watcher.stop()
+        return super().stop()
     
-    def toggle_pause(self):
-        if self._player is not None:
-            log.debug("Paused music")
-            self._player.pause()
-    
-    def on_press(self, key):
-        log.debug("Pressed key %s", key)
-        (action, vol, fade_time) = self.key_assignments.get(key, (None, None, None))
+    def compile_action(self, action, vol, fade_time):
+        """Turn a key assignment into a callable that returns the steps
+        for performing it (see ``AudioEngine.run()``).
+        
+        Fog-of-war actions don't involve the audio engine, so their
+        callables carry out the action straight away and return None.
+        
+        Parameters
+        ----------
+        action : str
+          Either a song file in ``MUSIC_DIR``, or one of "Stop",
+          "Pause", "VolUp" or "VolDown", or one of the fog-of-war
+          actions in ``maps.fog.FOG_ACTIONS``.
+        vol : int
+          Relative volume (in percent) for playing a song.
+        fade_time : float
+          Cross-fade time, in seconds, for playing a song.
+        
+        """
+        engine = self.engine
         if action == "Stop":
-            self.stop_music(fade_time=FADE_TIME)
+            handler = partial(engine.stop_music_steps, fade_time=FADE_TIME)
         elif action == 'VolUp':
-            self.change_volume(10)
+            handler = partial(engine.change_volume_steps, 10)
         elif action == 'VolDown':
-            self.change_volume(-10)
+            handler = partial(engine.change_volume_steps, -10)
         elif action == 'Pause':
-            self.toggle_pause()
-        elif action is not None:
-            vol_ratio = vol / 100 if vol is not None else 1
-            self.volume *= vol_ratio
+            handler = engine.toggle_pause_steps
+        elif action in FOG_ACTIONS:
+            handler = partial(self.fog_action, action)
+        else:
+            fade_time = fade_time if fade_time is not None else FADE_TIME
             song_file = os.path.join(MUSIC_DIR, action)
-            self.stop_music(fade_time=fade_time)
-            self.start_music(song_file, fade_time=fade_time)
+            handler = partial(engine.play_song_steps, song_file, vol, fade_time)
+        return handler
     
-    def change_volume(self, delta_vol):
-        new_vol = self.volume + delta_vol
-        old_vol = self.volume
-        # Make sure the new volume is within 0 and 100
-        new_vol = min(new_vol, self.max_volume)
-        new_vol = max(new_vol, self.min_volume)
-        # Execute the volume change
-        if self.volume != new_vol:
-            self.volume = new_vol
-            self.fade_volume(self.volume, fade_time=0.05)
-            log.debug("Changed volume from %d to %d", old_vol, new_vol)
-        else:
-            log.info("Volume NOT changed from %d to %d", old_vol, new_vol)
+    def fog_action(self, action):
+        """Carry out a fog-of-war action right away.
+        
+        These don't touch the audio, so they don't wait for the
+        engine to finish what it is doing.
+        
+        """
+        if self.fog is None:
+            log.warning("Fog action %s needs the map server", action)
+            return
+        try:
+            self.fog.do_action(action)
+        except MapError as e:
+            log.error("Could not do fog action %s: %s", action, e)
+    
+    def set_key_assignments(self, assignments):
+        """Compile and install a new set of key assignments.
+        
+        The new dispatch table is built completely before being
+        swapped in, so key presses in the meantime use the old one,
+        and the VLC instance and current playback are not disturbed.
+        
+        Parameters
+        ----------
+        assignments : dict
+          Maps keys to ``(action, volume, fade_time)`` tuples, like
+          ``MusicListener.key_assignments``.
+        
+        """
+        dispatch = {key: self.compile_action(*assignment)
+                    for key, assignment in assignments.items()
+                    if assignment[0] is not None}
+        self._dispatch = dispatch
+        log.debug("Installed %d key assignments", len(dispatch))
+   
+    def on_press(self, key):
+        log.debug("Pressed key %s", key)
+        if tracer.enabled:
+            tracer.instant('music.key', {'key': key})
+        if self.recorder is not None:
+            self.recorder.record_key(key)
+        # Using the numberpad keeps the player from being released
+        if self.engine.idle is not None:
+            self.engine.idle.touch()
+        self.handle_key(key)
+    
+    def handle_key(self, key):
+        """Carry out the action assigned to *key*."""
+        steps = self.key_steps(key)
+        if steps is not None:
+            self.engine.run(steps)
+    
+    def is_assigned(self, key):
+        """Whether *key* has an action assigned to it."""
+        return key in self._dispatch
+    
+    def key_steps(self, key):
+        """Return the engine steps for the action assigned to *key*, or
+        None if there is nothing for the engine to do."""
+        handler = self._dispatch.get(key)
+        return handler() if handler is not None else None
     
     def join(self, *args, **kwargs):
         log.info("D&D Music started. Waiting for keypress...")
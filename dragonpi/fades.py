@@ -0,0 +1,104 @@
+# This file is part of DragonPi.
+#
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Volume fade curves.
+
+Each curve is a precomputed table of gains going from 0 to 1. A fade
+is turned into a plan of ``(volume, hold_time)`` steps whose number
+depends on how long the fade lasts, so that short fades do not make
+more volume changes than can be heard, and long fades are still
+smooth. Steps that would not change the (integer) volume are merged
+into their neighbours.
+
+"""
+
+import math
+from functools import lru_cache
+
+# Number of entries in each curve table
+TABLE_SIZE = 256
+# Default time between volume updates, in seconds
+UPDATE_INTERVAL = 0.05
+
+
+def _table(func):
+    return tuple(func(i / (TABLE_SIZE - 1)) for i in range(TABLE_SIZE))
+
+
+CURVES = {
+    'linear': _table(lambda t: t),
+    # Keeps the combined power constant when cross-fading
+    'equal-power': _table(lambda t: math.sin(t * math.pi / 2)),
+    # Linear in decibels over a 40 dB range
+    'logarithmic': _table(lambda t: (10**(2 * t) - 1) / 99),
+}
+
+
+def num_steps(fade_time, volume_range=100, interval=UPDATE_INTERVAL):
+    """How many volume updates to use for a fade lasting *fade_time*
+    seconds over *volume_range* volume points.
+
+    There is one update every *interval*, but no more updates than
+    there are (integer) volume levels to go through.
+
+    """
+    steps = round(fade_time / interval)
+    return max(1, min(steps, abs(volume_range), TABLE_SIZE - 1))
+
+
+@lru_cache(maxsize=128)
+def fade_plan(start, end, fade_time, curve='equal-power',
+              interval=UPDATE_INTERVAL):
+    """Plan the volume changes for fading from *start* to *end*.
+
+    Parameters
+    ----------
+    start, end : int
+      Initial and final volume.
+    fade_time : float
+      Duration of the fade, in seconds.
+    curve : str
+      Name of the fade curve in ``CURVES``.
+    interval : float
+      Target time between volume changes, in seconds.
+
+    Returns
+    -------
+    plan : tuple
+      ``(volume, hold_time)`` pairs: set the volume, then wait
+      *hold_time* seconds before the next step. The last step is
+      always *end*, and the hold times add up to *fade_time*.
+
+    """
+    table = CURVES[curve]
+    steps = num_steps(fade_time, end - start, interval=interval)
+    hold_time = fade_time / steps
+    plan = []
+    for i in range(1, steps + 1):
+        t = i / steps
+        if end >= start:
+            gain = table[round(t * (TABLE_SIZE - 1))]
+            volume = start + (end - start) * gain
+        else:
+            # Fading out is the mirror image of fading in
+            gain = table[round((1 - t) * (TABLE_SIZE - 1))]
+            volume = end + (start - end) * gain
+        volume = round(volume)
+        if plan and plan[-1][0] == volume:
+            # Merge with the previous step since nothing changes
+            plan[-1] = (volume, plan[-1][1] + hold_time)
+        else:
+            plan.append((volume, hold_time))
+    return tuple(plan)
@@ -0,0 +1,150 @@
+# This file is part of DragonPi.
+#
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+"""A stand-in for the parts of python-vlc that DragonPi uses.
+
+Used for replaying recorded sessions and for testing on machines
+without audio hardware. Nothing is actually played, but the players
+keep track of their state so it can be inspected.
+
+"""
+
+import logging
+log = logging.getLogger(__name__)
+import time
+from collections import Counter
+
+from vlc import State
+
+
+class FakeMedia():
+    def __init__(self, mrl, instance=None):
+        self.mrl = mrl
+        self.instance = instance
+        self.released = False
+
+    def get_mrl(self):
+        return self.mrl
+
+    def release(self):
+        if not self.released and self.instance is not None:
+            self.instance.live['media'] -= 1
+        self.released = True
+
+
+class FakeMediaPlayer():
+    # Seconds between ``play()`` and actually playing, while libvlc
+    # opens the media
+    startup_time = 0.005
+
+    def __init__(self, media=None, instance=None):
+        self.instance = instance
+        self.released = False
+        self.media = media
+        self.volume = 100
+        self.device = None
+        self.is_playing = False
+        self._started = None
+        self._position = 0
+
+    def get_media(self):
+        return self.media
+
+    def set_media(self, media):
+        self.media = media
+
+    def play(self):
+        self.is_playing = True
+        self._started = time.monotonic() + self.startup_time
+        return 0
+
+    def get_state(self):
+        if self.is_playing:
+            opening = time.monotonic() < self._started
+            return State.Opening if opening else State.Playing
+        elif self._position:
+            return State.Paused
+        return State.Stopped
+
+    def stop(self):
+        self.is_playing = False
+        self._position = 0
+        self._started = None
+
+    def pause(self):
+        # Toggle the pause state, like libvlc does
+        if self.is_playing:
+            self._position = self.get_time()
+            self._started = None
+            self.is_playing = False
+        else:
+            self.is_playing = True
+            self._started = time.monotonic()
+
+    def get_time(self):
+        """Current position, in milliseconds."""
+        time_ms = self._position
+        if self._started is not None:
+            time_ms += max(round((time.monotonic() - self._started) * 1000), 0)
+        return time_ms
+
+    def set_time(self, time_ms):
+        if self.get_state() == State.Opening:
+            # libvlc ignores seeking until the media is playing
+            log.debug("Ignoring seek to %d ms while opening", time_ms)
+            return
+        self._position = time_ms
+        if self._started is not None:
+            self._started = time.monotonic()
+
+    def audio_get_volume(self):
+        return self.volume
+
+    def audio_set_volume(self, volume):
+        self.volume = volume
+        return 0
+
+    def audio_output_device_set(self, module, device_id):
+        self.device = device_id
+
+    def audio_output_device_get(self):
+        return self.device
+
+    def release(self):
+        self.stop()
+        if not self.released and self.instance is not None:
+            self.instance.live['player'] -= 1
+        self.released = True
+
+
+class FakeInstance():
+    """Replacement for ``vlc.Instance``.
+
+    ``live`` counts the media and players that have been created but
+    not released yet.
+
+    """
+    def __init__(self, *args):
+        log.debug("Created fake VLC instance with %s", args)
+        self.live = Counter()
+
+    def media_new(self, mrl):
+        self.live['media'] += 1
+        return FakeMedia(mrl, instance=self)
+
+    def media_player_new(self, uri=None):
+        media = self.media_new(uri) if uri is not None else None
+        self.live['player'] += 1
+        return FakeMediaPlayer(media, instance=self)
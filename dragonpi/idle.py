@@ -0,0 +1,140 @@
+# This file is part of DragonPi.
+#
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Notice when nothing is happening so resources can be released.
+
+The program counts as idle once no music has been playing and nobody
+has touched the numberpad or LCD buttons for ``timeout`` seconds.
+
+"""
+
+import logging
+log = logging.getLogger(__name__)
+import threading
+
+# Default time before going idle, in seconds
+IDLE_TIMEOUT = 600
+
+
+class IdleManager():
+    """Keep track of activity and tell subscribers when it stops.
+
+    Parameters
+    ----------
+    timeout : float
+      Seconds without activity before going idle. If None, the
+      program never goes idle.
+    call_soon
+      Used to run the callbacks, e.g. ``loop.call_soon_threadsafe``
+      to run them on an asyncio event loop. By default they are
+      called directly from the timer thread.
+
+    """
+    is_idle = False
+    loop = None
+
+    def __init__(self, timeout=IDLE_TIMEOUT, call_soon=None):
+        self.timeout = timeout
+        self.call_soon = call_soon
+        self._busy = False
+        # A threading.Timer, or an asyncio.TimerHandle when using a loop
+        self._timer = None
+        self._generation = 0
+        self._subscribers = []
+        self._lock = threading.RLock()
+
+    def use_loop(self, loop):
+        """Count down with timers on the asyncio event *loop*, instead
+        of starting a thread for each countdown, and run the callbacks
+        on the loop too."""
+        self.cancel()
+        self.loop = loop
+        self.call_soon = loop.call_soon_threadsafe
+
+    def subscribe(self, on_idle=None, on_active=None):
+        """Register callbacks for going idle and becoming active again."""
+        self._subscribers.append((on_idle, on_active))
+
+    def set_busy(self, busy):
+        """Mark whether something (e.g. music playing) is going on that
+        should keep the program from going idle."""
+        with self._lock:
+            self._busy = busy
+        self.touch()
+
+    def touch(self):
+        """Record user activity, and restart the idle countdown."""
+        with self._lock:
+            was_idle = self.is_idle
+            self.is_idle = False
+            # Restart the countdown
+            self._generation += 1
+            if self.loop is not None:
+                # Touches come from several threads, so the loop's
+                # timer is handled from the loop's own thread
+                self.loop.call_soon_threadsafe(self._restart_timer, self._generation)
+            else:
+                self._restart_timer(self._generation)
+        if was_idle:
+            log.info("Waking up from idle")
+            self._notify(1)
+
+    def cancel(self):
+        """Stop the idle countdown, e.g. when shutting down."""
+        with self._lock:
+            self._generation += 1
+            self._cancel_timer()
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _restart_timer(self, generation):
+        with self._lock:
+            if generation != self._generation:
+                # Already restarted (or cancelled) again
+                return
+            self._cancel_timer()
+            if self._busy or self.timeout is None:
+                return
+            if self.loop is not None:
+                self._timer = self.loop.call_later(self.timeout, self._go_idle,
+                                                   generation)
+            else:
+                self._timer = threading.Timer(self.timeout, self._go_idle,
+                                              args=(generation,))
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _go_idle(self, generation):
+        with self._lock:
+            # Ignore countdowns that were restarted in the meantime
+            if self._busy or self.is_idle or generation != self._generation:
+                return
+            self.is_idle = True
+            self._timer = None
+        log.info("Going idle after %s seconds", self.timeout)
+        self._notify(0)
+
+    def _notify(self, which):
+        for callbacks in self._subscribers:
+            callback = callbacks[which]
+            if callback is None:
+                continue
+            if self.call_soon is not None:
+                self.call_soon(callback)
+            else:
+                callback()
@@ -0,0 +1,269 @@
+# This file is part of DragonPi.
+#
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Load numberpad key assignments from a TOML or JSON file.
+
+A keymap file holds a list of ``key`` tables, each describing one key
+and the action it triggers::
+
+    [[key]]
+    key = "1"
+    action = "battle_music_1.mp3"
+    volume = 100
+    fade_time = 0.3
+
+    [[key]]
+    key = "<enter>"
+    action = "Stop"
+
+Keys are given either as a single character (``"1"``), a special key
+name in angle brackets (``"<enter>"``) or a virtual key code
+(``"<vk:65437>"``). The file is loaded into the same ``(action,
+volume, fade_time)`` assignments that
+``dndmusic.MusicListener.key_assignments`` uses.
+
+"""
+
+import logging
+log = logging.getLogger(__name__)
+import ctypes
+import ctypes.util
+import errno
+import json
+import os
+import re
+import select
+import struct
+import threading
+
+from pynput import keyboard
+
+try:
+    import tomllib
+except ImportError:
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+vk_re = re.compile(r'^<vk:(\d+)>$')
+name_re = re.compile(r'^<(\w+)>$')
+
+
+class KeymapError(ValueError):
+    """The keymap file could not be understood."""
+
+
+def parse_key(spec):
+    """Convert a key description from a keymap file into a pynput key.
+
+    Parameters
+    ----------
+    spec : str
+      A single character, a special key name like ``"<enter>"`` or a
+      virtual key code like ``"<vk:65437>"``.
+
+    Returns
+    -------
+    key
+      The ``keyboard.Key`` or ``keyboard.KeyCode`` for this spec.
+
+    """
+    vk_match = vk_re.match(spec)
+    name_match = name_re.match(spec)
+    if vk_match:
+        key = keyboard.KeyCode.from_vk(int(vk_match.group(1)))
+    elif name_match:
+        try:
+            key = keyboard.Key[name_match.group(1)]
+        except KeyError:
+            raise KeymapError(f"Unknown key name: {spec}")
+    elif len(spec) == 1:
+        key = keyboard.KeyCode.from_char(spec)
+    else:
+        raise KeymapError(f"Cannot parse key: {spec}")
+    return key
+
+
+def key_to_spec(key):
+    """Convert a pynput key into its keymap file description.
+
+    This is the inverse of ``parse_key()``.
+
+    """
+    if isinstance(key, keyboard.Key):
+        spec = f'<{key.name}>'
+    elif getattr(key, 'char', None) is not None:
+        spec = key.char
+    else:
+        spec = f'<vk:{key.vk}>'
+    return spec
+
+
+def load_keymap(filename):
+    """Load key assignments from a TOML or JSON keymap file.
+
+    Parameters
+    ----------
+    filename : str
+      Path to the keymap file. Files ending in ``.json`` are read as
+      JSON, everything else as TOML.
+
+    Returns
+    -------
+    assignments : dict
+      Maps each pynput key to an ``(action, volume, fade_time)``
+      tuple.
+
+    """
+    if filename.endswith('.json'):
+        with open(filename, mode='r') as fp:
+            data = json.load(fp)
+    elif tomllib is None:
+        raise KeymapError(f"Reading {filename} needs tomllib (python 3.11+) or tomli.")
+    else:
+        with open(filename, mode='rb') as fp:
+            data = tomllib.load(fp)
+    # Convert the file's entries into key assignments
+    assignments = {}
+    try:
+        for entry in data['key']:
+            key = parse_key(entry['key'])
+            assignments[key] = (entry['action'],
+                                entry.get('volume'),
+                                entry.get('fade_time'))
+    except (KeyError, TypeError) as e:
+        raise KeymapError(f"Invalid keymap file {filename}: {e!r}")
+    return assignments
+
+
+class _inotify_event(ctypes.Structure):
+    _fields_ = [('wd', ctypes.c_int),
+                ('mask', ctypes.c_uint32),
+                ('cookie', ctypes.c_uint32),
+                ('len', ctypes.c_uint32)]
+
+
+class KeymapWatcher(threading.Thread):
+    """Watch a keymap file and call back with new assignments when it
+    changes.
+
+    Uses inotify on the file's directory so that editors which save
+    by renaming a temporary file are noticed too. If inotify is not
+    available, the file's modification time is polled instead.
+
+    Parameters
+    ----------
+    filename : str
+      Path to the keymap file to watch.
+    callback
+      Called with the newly loaded assignments each time the file is
+      successfully re-read.
+    poll_interval : float
+      How often, in seconds, to check for changes (or for a stop
+      request).
+
+    """
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_CLOEXEC = 0o2000000
+    IN_NONBLOCK = 0o4000
+
+    def __init__(self, filename, callback, poll_interval=1.0):
+        super().__init__(name='KeymapWatcher', daemon=True)
+        self.filename = os.path.abspath(filename)
+        self.callback = callback
+        self.poll_interval = poll_interval
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def reload(self):
+        """Re-read the keymap file and pass it to the callback."""
+        try:
+            assignments = load_keymap(self.filename)
+        except (OSError, ValueError) as e:
+            # Keep using the old keymap
+            log.error("Could not reload keymap %s: %s", self.filename, e)
+        else:
+            log.info("Reloaded keymap from %s", self.filename)
+            self.callback(assignments)
+
+    def _inotify_fd(self):
+        """Open an inotify watch on the keymap directory, or return None."""
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            return None
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            return None
+        fd = libc.inotify_init1(self.IN_CLOEXEC | self.IN_NONBLOCK)
+        if fd < 0:
+            return None
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        dirname = os.path.dirname(self.filename).encode()
+        if libc.inotify_add_watch(fd, dirname, mask) < 0:
+            log.warning("inotify_add_watch failed: %s",
+                        errno.errorcode.get(ctypes.get_errno()))
+            os.close(fd)
+            return None
+        return fd
+
+    def _read_names(self, fd):
+        """Read pending inotify events and return the changed file names."""
+        names = set()
+        try:
+            buf = os.read(fd, 4096)
+        except BlockingIOError:
+            return names
+        header_size = ctypes.sizeof(_inotify_event)
+        offset = 0
+        while offset + header_size <= len(buf):
+            wd, mask, cookie, length = struct.unpack_from('iIII', buf, offset)
+            offset += header_size
+            name = buf[offset:offset+length].rstrip(b'\0')
+            offset += length
+            names.add(os.fsdecode(name))
+        return names
+
+    def run(self):
+        fd = self._inotify_fd()
+        basename = os.path.basename(self.filename)
+        if fd is None:
+            log.info("inotify not available, polling %s", self.filename)
+            self._poll_mtime()
+            return
+        try:
+            while not self._stop_event.is_set():
+                readable, _, _ = select.select([fd], [], [], self.poll_interval)
+                if readable and basename in self._read_names(fd):
+                    self.reload()
+        finally:
+            os.close(fd)
+
+    def _poll_mtime(self):
+        def mtime():
+            try:
+                return os.stat(self.filename).st_mtime_ns
+            except OSError:
+                return None
+        last_mtime = mtime()
+        while not self._stop_event.wait(self.poll_interval):
+            new_mtime = mtime()
+            if new_mtime is not None and new_mtime != last_mtime:
+                last_mtime = new_mtime
+                self.reload()
@@ -25,9 +25,12 @@ log = logging.getLogger(__name__)
 import warnings
 import contextlib
 import time
-from subprocess import call, check_output
-import re
 import os
+from collections import OrderedDict
+from collections.abc import Sequence
+
+from .display import DisplayWriter, Frame
+from .trace import tracer
 
 CHECKMARK = '\x01'
 
@@ -44,6 +47,9 @@ class DummyLCD():
     def message(self, s, *args, **kwargs):
         log.debug('Dummy logger message: %s', s)
 
+    def set_cursor(self, col, row):
+        log.debug('Dummy cursor set: %d, %d', col, row)
+
     def set_color(self, *color):
         log.debug('Dummy color set: %s', str(color))
 
@@ -55,8 +61,36 @@ class DummyLCD():
 
 
 class LCDMenu():
-    _active_item_idx = 0
-    _menu_items = []
+    """A menu driven by the LCD plate's buttons.
+    
+    Parameters
+    ----------
+    lcd
+      The display whose buttons control the menu; by default the LCD
+      plate.
+    recorder : recording.EventRecorder
+      Optional recorder for button presses.
+    idle : idle.IdleManager
+      Slows down the button scanning while idle.
+    displays
+      Extra ``display.DisplayWriter`` instances that mirror the menu.
+    status
+      Called to get extra lines (e.g. what's playing) for displays
+      with more than two lines.
+    
+    """
+    recorder = None
+    status = None
+    # Seconds between checking whether the status lines changed
+    status_interval = 1.
+    # How many submenus keep their entries after being left
+    max_cached_submenus = 4
+    # Seconds between checking the buttons, normally and when idle
+    active_scan_interval = 0.02
+    idle_scan_interval = 0.25
+    scan_interval = active_scan_interval
+    # Button scans slower than this (in seconds) show up in the trace
+    slow_poll_time = 0.01
     #CharLCDplatebuttonnames.
     SELECT = 0
     RIGHT = 1
@@ -67,7 +101,7 @@ class LCDMenu():
     WHITE = (1.0, 1.0, 1.0)
     RED = (1.0, 0.0, 0.0)
     
-    def __init__(self, lcd=None):
+    def __init__(self, lcd=None, recorder=None, idle=None, displays=(), status=None):
         # Get default LCD display
         if lcd is None:
             try:
@@ -78,15 +112,30 @@ class LCDMenu():
                 warnings.warn("Could not load ADafruit_CharLCDPlate", RuntimeWarning)
                 lcd = DummyLCD()
         self.lcd = lcd
+        # Each display keeps track of what it is showing
+        self.displays = [DisplayWriter(lcd), *displays]
+        self.recorder = recorder
+        self.status = status
+        self._last_refresh = 0
+        self.idle = idle
+        if idle is not None:
+            idle.subscribe(on_idle=self.slow_scan, on_active=self.fast_scan)
         self.init_lcd()
         # Create an empty array to hold new menu items
-        self._menu_items = []
+        self._root_items = []
+        self._menu_items = self._root_items
+        self._active_item_idx = 0
+        # (items, active_idx) of the menus above the current one
+        self._parents = []
+        self._cached_submenus = OrderedDict()
+        self._held_button = None
 
     def init_lcd(self):
-        self.lcd.set_color(*self.WHITE)
         # Set custom characters
-        self.lcd.create_char(int_from_hex_string(CHECKMARK),
-                             [0,1,3,22,28,8,0,0])
+        for display in self.displays:
+            display.set_color(self.WHITE)
+            display.lcd.create_char(int_from_hex_string(CHECKMARK),
+                                    [0,1,3,22,28,8,0,0])
         
     
     def add_entries(self, *entries):
@@ -98,53 +147,154 @@ class LCDMenu():
           Any number of new menu items to be added to the menu.
         
         """
-        self._menu_items.extend(entries)
+        self._root_items.extend(entries)
+    
+    def enter(self, submenu):
+        """Show the entries of *submenu* in place of the current menu."""
+        entries = submenu.entries()
+        if len(entries) == 0:
+            raise NotImplementedError(f"{submenu.name} is empty")
+        self._parents.append((self._menu_items, self._active_item_idx))
+        self._menu_items = entries
+        self._active_item_idx = 0
+        # Keep track of which submenus have recently built entries
+        self._cached_submenus.pop(id(submenu), None)
+        self._cached_submenus[id(submenu)] = submenu
+        self._evict_submenus()
+    
+    def back(self):
+        """Return to the menu above the current submenu."""
+        self._menu_items, self._active_item_idx = self._parents.pop()
+    
+    def _evict_submenus(self):
+        """Throw away entries of the least recently entered submenus."""
+        open_menus = [items for items, idx in self._parents] + [self._menu_items]
+        candidates = list(self._cached_submenus.values())
+        for submenu in candidates:
+            if len(self._cached_submenus) <= self.max_cached_submenus:
+                break
+            # Don't evict menus that are currently being shown
+            if any(submenu.cached_entries is items for items in open_menus):
+                continue
+            submenu.evict()
+            del self._cached_submenus[id(submenu)]
+    
+    def buttons(self):
+        """List of (button, handler) pairs in the order they are checked."""
+        return ((self.SELECT, self.select_pressed),
+                (self.LEFT, self.left_pressed),
+                (self.RIGHT, self.right_pressed),
+                (self.UP, self.up_pressed),
+                (self.DOWN, self.down_pressed),)
+    
+    def slow_scan(self):
+        """Check the buttons less often, e.g. while idle."""
+        self.scan_interval = self.idle_scan_interval
+    
+    def fast_scan(self):
+        """Check the buttons at the normal rate."""
+        self.scan_interval = self.active_scan_interval
+    
+    def press(self, button):
+        """Respond to *button* being pressed, as if on the LCD plate."""
+        if self.idle is not None:
+            self.idle.touch()
+        if self.recorder is not None:
+            self.recorder.record_button(button)
+        with tracer.span('lcd.button', button=button):
+            dict(self.buttons())[button]()
+    
+    def poll(self):
+        """Check each button once, and respond if one was just pressed.
+        
+        Returns
+        -------
+        bool
+          Whether any button is being held down.
+        
+        """
+        start = time.perf_counter_ns()
+        pressed = next((button for button, handler in self.buttons()
+                        if self.lcd.is_pressed(button)), None)
+        # Only trace slow scans, so the frequent polls don't push the
+        # fade and I2C events out of the trace buffer
+        if tracer.enabled and time.perf_counter_ns() - start > self.slow_poll_time * 1e9:
+            tracer.complete('lcd.poll', start)
+        if pressed is not None:
+            # Only respond once until the button is released
+            if pressed != self._held_button:
+                self._held_button = pressed
+                self.press(pressed)
+            return True
+        self._held_button = None
+        # Keep the status lines up to date
+        if (self.status is not None
+            and time.monotonic() - self._last_refresh >= self.status_interval):
+            self.refresh_text()
+        return False
     
     def join(self):
         """Monitor the LCD menu for button presses."""
         self.refresh_text()
-        buttons = ((self.SELECT, self.select_pressed),
-                   (self.LEFT, self.left_pressed),
-                   (self.RIGHT, self.right_pressed),
-                   (self.UP, self.up_pressed),
-                   (self.DOWN, self.down_pressed),)
         while True:
-            # Check status of each button
-            for button in buttons:
-                if self.lcd.is_pressed(button[0]):
-                    button[1]()
-                    # Wait for the button to be released
-                    while self.lcd.is_pressed(button[0]):
-                        pass
+            held = self.poll()
+            time.sleep(self.active_scan_interval if held else self.scan_interval)
 
     @contextlib.contextmanager
     def press_button(self):
         try:
             yield
         except NotImplementedError:
-            self.lcd.set_color(*self.RED)
+            # Flash every display, and keep their writers up to date
+            for display in self.displays:
+                display.set_color(self.RED)
             time.sleep(0.3)
-            self.lcd.set_color(*self.WHITE)
+            for display in self.displays:
+                display.set_color(self.WHITE)
     
-    def refresh_text(self):
-        """Update the display text from the current menu item."""
-        self.lcd.clear()
-        # Set the new text
+    def frame(self):
+        """Describe what the displays should show right now."""
         item = self.active_item()
-        self.lcd.message(f'{item.name}\n{item.active_text()}')
+        status = tuple(self.status()) if self.status is not None else ()
+        return Frame(str(item.name), str(item.active_text()), status, self.WHITE)
+    
+    def refresh_text(self):
+        """Update the displays from the current menu item."""
+        with tracer.span('lcd.refresh'):
+            self._last_refresh = time.monotonic()
+            frame = self.frame()
+            for display in self.displays:
+                display.show(frame)
     
     def active_item(self):
         return self._menu_items[self._active_item_idx]
     
     def select_pressed(self):
         """Respond when the "Select" button is pressed."""
-        self.active_item().select()
+        item = self.active_item()
+        if isinstance(item, Submenu):
+            with self.press_button():
+                self.enter(item)
+        elif isinstance(item, Back) and self._parents:
+            self.back()
+        else:
+            item.select()
         self.refresh_text()
     
     def left_pressed(self):
-        """Respond when the "Left" button is pressed."""
+        """Respond when the "Left" button is pressed.
+        
+        Leaves the current submenu if the active item doesn't use the
+        "Left" button itself.
+        
+        """
         with self.press_button():
-            self.active_item().move_left()
+            try:
+                self.active_item().move_left()
+            except NotImplementedError:
+                if not self._parents:
+                    raise
+                self.back()
         self.refresh_text()
     
     def right_pressed(self):
@@ -187,6 +337,113 @@ class MenuItem():
         return f"[{self.name} text]"
 
 
+class Submenu(MenuItem):
+    """A menu item that opens a list of further menu items.
+    
+    The entries are only built (by ``build_entries()``) when the
+    submenu is first entered, and kept until ``evict()`` is called.
+    
+    """
+    name = "Submenu"
+    cached_entries = None
+    
+    def build_entries(self):
+        """Create the menu items in this submenu.
+        
+        Returns
+        -------
+        entries : Sequence
+          The menu items, either as a list or as a lazy sequence like
+          ``PagedEntries``.
+        
+        """
+        raise NotImplementedError()
+    
+    def entries(self):
+        if self.cached_entries is None:
+            log.debug("Building entries for %s", self.name)
+            self.cached_entries = self.build_entries()
+        return self.cached_entries
+    
+    def evict(self):
+        """Forget the entries so they get rebuilt next time."""
+        log.debug("Evicting entries for %s", self.name)
+        self.cached_entries = None
+    
+    def active_text(self):
+        return "Select to open"
+
+
+class Back(MenuItem):
+    """Leaves the submenu it is in when selected.
+    
+    Needed for submenus whose items use the "Left" button themselves.
+    
+    """
+    name = "Back"
+    
+    def active_text(self):
+        return "Select to leave"
+
+
+class MenuGroup(Submenu):
+    """A submenu whose entries come from calling *factory*, followed
+    by a ``Back`` entry."""
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+    
+    def build_entries(self):
+        entries = list(self.factory())
+        if entries:
+            entries.append(Back())
+        return entries
+
+
+class PagedEntries(Sequence):
+    """A long sequence of menu items that are built a page at a time.
+    
+    Parameters
+    ----------
+    length : int
+      Total number of items.
+    make_page
+      Called as ``make_page(start, stop)`` to build the items with
+      indices from *start* up to *stop*.
+    page_size : int
+      Number of items built at once.
+    max_pages : int
+      Number of pages to keep before building them again.
+    
+    """
+    def __init__(self, length, make_page, page_size=16, max_pages=4):
+        self.length = length
+        self.make_page = make_page
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self._pages = OrderedDict()
+    
+    def __len__(self):
+        return self.length
+    
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += self.length
+        if not 0 <= idx < self.length:
+            raise IndexError(idx)
+        page_num, offset = divmod(idx, self.page_size)
+        page = self._pages.pop(page_num, None)
+        if page is None:
+            start = page_num * self.page_size
+            stop = min(start + self.page_size, self.length)
+            page = self.make_page(start, stop)
+        self._pages[page_num] = page
+        # Drop the least recently used pages
+        while len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+        return page[offset]
+
+
 class Greeting(MenuItem):
     @property
     def name(self):
@@ -199,10 +456,20 @@ class Greeting(MenuItem):
 
 
 class AudioOutput(MenuItem):
+    """Choose where the audio engine sends its sound.
+    
+    Parameters
+    ----------
+    engine : audio.AudioEngine
+      The engine whose output gets switched.
+    
+    """
     name = "Audio Output"
     highlight_idx = 0
     source_names = ['Auto', 'Analog 1/4"', 'HDMI']
-    curr_val_re = re.compile(': values=(\d+)')
+    
+    def __init__(self, engine):
+        self.engine = engine
     
     def active_text(self):
         txt = self.source_names[self.highlight_idx]
@@ -225,14 +492,77 @@ class AudioOutput(MenuItem):
 
     @property
     def active_idx(self):
-        output = check_output(['amixer', 'cget', 'numid=3'])
-        output = output.decode('ascii')
-        # Search the output for the necessary value
-        curr_match = self.curr_val_re.search(output)
-        idx = int(curr_match.group(1)) if curr_match else 0
-        return idx
+        return self.engine.output_idx
 
     def select(self):
-        new_idx = self.highlight_idx
-        # Update the active item
-        call(['amixer', 'cset', 'numid=3', str(new_idx)])
+        # Blocks until the engine has actually switched over
+        self.engine.set_output(self.highlight_idx)
+
+
+class Volume(MenuItem):
+    """Turn the audio engine's volume up and down."""
+    name = "Volume"
+    step = 10
+    
+    def __init__(self, engine):
+        self.engine = engine
+    
+    def active_text(self):
+        return f"< {round(self.engine.volume)}% >"
+    
+    def move_right(self):
+        self.engine.change_volume(self.step)
+    
+    def move_left(self):
+        self.engine.change_volume(-self.step)
+
+
+class Track(MenuItem):
+    """A song that can be played from the track browser."""
+    def __init__(self, engine, song_file, fade_time):
+        self.engine = engine
+        self.song_file = song_file
+        self.fade_time = fade_time
+        self.name = os.path.basename(song_file)
+    
+    def active_text(self):
+        if self.engine.song_file == self.song_file:
+            return f"{CHECKMARK} Playing"
+        return "Select to play"
+    
+    def select(self):
+        self.engine.play_song(self.song_file, None, self.fade_time)
+
+
+class TrackBrowser(Submenu):
+    """Browse and play the songs in a directory.
+    
+    Only the file names are listed when the browser is entered, and
+    ``Track`` items are built a page at a time as they are shown.
+    
+    Parameters
+    ----------
+    engine : audio.AudioEngine
+      The engine that plays the songs.
+    music_dir : str
+      Directory holding the songs.
+    fade_time : float
+      Cross-fade time, in seconds, for switching songs.
+    
+    """
+    name = "Track Browser"
+    
+    def __init__(self, engine, music_dir, fade_time=1.5):
+        self.engine = engine
+        self.music_dir = music_dir
+        self.fade_time = fade_time
+    
+    def build_entries(self):
+        with os.scandir(self.music_dir) as it:
+            names = sorted(entry.name for entry in it
+                           if entry.is_file() and not entry.name.startswith('.'))
+        names = tuple(names)
+        def make_page(start, stop):
+            return [Track(self.engine, os.path.join(self.music_dir, name), self.fade_time)
+                    for name in names[start:stop]]
+        return PagedEntries(len(names), make_page)
@@ -0,0 +1,93 @@
+# This file is part of DragonPi.
+#
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Wait for the short delays needed when talking to an LCD controller.
+
+Busy-waiting holds the GIL and keeps a core at 100%, which starves
+the music thread. Instead, ``HybridTimer`` sleeps for most of a wait
+and only spins for the last ``spin_ns`` nanoseconds, where
+``time.sleep()`` would be too coarse.
+
+Rather than pausing a fixed time before every byte, a
+``SettleDeadline`` remembers when the controller will be ready
+again. Time spent on other things in the meantime (e.g. the I2C
+transfers for the next byte) counts towards the wait, so a run of
+bytes usually doesn't wait at all.
+
+"""
+
+import time
+
+SPIN_NS = 100_000
+
+
+class HybridTimer():
+    """Sleep, then spin, until a deadline.
+
+    Parameters
+    ----------
+    clock
+      Returns the current time in nanoseconds.
+    sleep
+      Sleeps for a given number of seconds.
+    spin_ns : int
+      How long before the deadline to stop sleeping and start
+      spinning, in nanoseconds.
+
+    """
+    spin_ns = SPIN_NS
+
+    def __init__(self, clock=time.perf_counter_ns, sleep=time.sleep, spin_ns=None):
+        self.clock = clock
+        self.sleep = sleep
+        if spin_ns is not None:
+            self.spin_ns = spin_ns
+
+    def wait_until(self, deadline_ns):
+        """Return once ``clock()`` has reached *deadline_ns*."""
+        clock = self.clock
+        remaining = deadline_ns - clock()
+        if remaining > self.spin_ns:
+            self.sleep((remaining - self.spin_ns) / 1e9)
+        while clock() < deadline_ns:
+            pass
+
+    def delay_us(self, microseconds):
+        """Wait for *microseconds* from now."""
+        self.wait_until(self.clock() + int(microseconds * 1000))
+
+
+class SettleDeadline():
+    """Keep track of when a device will be ready for the next command.
+
+    Parameters
+    ----------
+    timer : HybridTimer
+      Used for waiting, and for its clock.
+
+    """
+    def __init__(self, timer=None):
+        self.timer = timer if timer is not None else HybridTimer()
+        self.ready_ns = 0
+
+    def extend(self, microseconds):
+        """The device will be busy for *microseconds* from now."""
+        ready_ns = self.timer.clock() + int(microseconds * 1000)
+        self.ready_ns = max(self.ready_ns, ready_ns)
+
+    def wait(self):
+        """Wait until the device is ready, if it isn't already."""
+        if self.timer.clock() < self.ready_ns:
+            self.timer.wait_until(self.ready_ns)
@@ -0,0 +1,315 @@
+# This file is part of DragonPi.
+#
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Keep track of which parts of the maps the party has explored.
+
+Each map is divided into square cells, and a ``FogMask`` holds one
+bit per cell. Revealing part of a map only touches the affected bits,
+and the ``FogBoard`` tells the connected displays about just the
+region that changed, so the map images themselves never need to be
+redrawn or sent again.
+
+"""
+
+import logging
+log = logging.getLogger(__name__)
+import base64
+import queue
+import threading
+
+CELL_SIZE = 32
+BRUSH_RADIUS = 2
+
+# Numberpad actions for moving the GM's cursor and revealing the map
+FOG_ACTIONS = {
+    'FogLeft': ('move_cursor', (-1, 0)),
+    'FogRight': ('move_cursor', (1, 0)),
+    'FogUp': ('move_cursor', (0, -1)),
+    'FogDown': ('move_cursor', (0, 1)),
+    'FogReveal': ('reveal', ()),
+    'FogHide': ('hide', ()),
+}
+
+
+class FogMask():
+    """One bit per map cell: set if the cell has been revealed.
+
+    Bits are packed row by row, most significant bit first, without
+    padding between the rows.
+
+    Parameters
+    ----------
+    width, height : int
+      Size of the map, in cells.
+    bits : bytes
+      Initial packed bits, e.g. from ``region()``; all hidden if
+      omitted.
+
+    """
+    def __init__(self, width, height, bits=None):
+        self.width = width
+        self.height = height
+        num_bytes = (width * height + 7) // 8
+        self.bits = bytearray(bits if bits is not None else num_bytes)
+        if len(self.bits) != num_bytes:
+            raise ValueError(f"Expected {num_bytes} bytes for {width}x{height} cells.")
+
+    def __getitem__(self, cell):
+        x, y = cell
+        idx = y * self.width + x
+        return bool(self.bits[idx >> 3] & (0x80 >> (idx & 7)))
+
+    def count(self):
+        """How many cells have been revealed."""
+        return sum(bin(b).count('1') for b in self.bits)
+
+    def update(self, cells, revealed=True):
+        """Reveal (or hide) some cells.
+
+        Parameters
+        ----------
+        cells
+          Iterable of ``(x, y)`` cells; ones outside the map are
+          ignored.
+        revealed : bool
+          Whether to reveal or hide the cells.
+
+        Returns
+        -------
+        changed : tuple
+          ``(x, y, width, height)`` bounding box of the cells that
+          actually changed, or None if none did.
+
+        """
+        bits = self.bits
+        x0 = y0 = x1 = y1 = None
+        for x, y in cells:
+            if not (0 <= x < self.width and 0 <= y < self.height):
+                continue
+            idx = y * self.width + x
+            mask = 0x80 >> (idx & 7)
+            byte = bits[idx >> 3]
+            if bool(byte & mask) == revealed:
+                continue
+            bits[idx >> 3] = byte | mask if revealed else byte & ~mask
+            if x0 is None:
+                x0, y0, x1, y1 = x, y, x, y
+            else:
+                x0, y0, x1, y1 = min(x0, x), min(y0, y), max(x1, x), max(y1, y)
+        if x0 is None:
+            return None
+        return (x0, y0, x1 - x0 + 1, y1 - y0 + 1)
+
+    def fill(self, revealed=True):
+        """Reveal (or hide) every cell.
+
+        Returns the whole mask as the changed region, or None if
+        nothing changed.
+
+        """
+        bits = bytearray(b'\xff' * len(self.bits) if revealed else len(self.bits))
+        # Leave the padding at the end clear
+        extra = len(bits) * 8 - self.width * self.height
+        if revealed and extra:
+            bits[-1] &= (0xff << extra) & 0xff
+        if bits == self.bits:
+            return None
+        self.bits[:] = bits
+        return (0, 0, self.width, self.height)
+
+    def update_circle(self, x, y, radius, revealed=True):
+        """Reveal (or hide) the cells within *radius* cells of (*x*, *y*)."""
+        # Only visit cells on the map, however big the circle is
+        cells = ((cx, cy)
+                 for cy in range(max(y - radius, 0), min(y + radius + 1, self.height))
+                 for cx in range(max(x - radius, 0), min(x + radius + 1, self.width))
+                 if (cx - x) ** 2 + (cy - y) ** 2 <= radius ** 2)
+        return self.update(cells, revealed=revealed)
+
+    def region(self, x, y, width, height):
+        """Pack the bits for a rectangle of cells, the same way as the
+        whole mask."""
+        if (x, y, width, height) == (0, 0, self.width, self.height):
+            return bytes(self.bits)
+        region = FogMask(width, height)
+        region.update((cx - x, cy - y)
+                      for cy in range(y, y + height)
+                      for cx in range(x, x + width)
+                      if self[cx, cy])
+        return bytes(region.bits)
+
+
+class FogBoard():
+    """The fog-of-war for every map, and the displays watching it.
+
+    Changes are published to subscribers as ``(event, data)`` tuples:
+
+    ``('map', {'map': name, 'cell_size': ..., 'w': ..., 'h': ...})``
+      A different map is being shown; its fog has *w* x *h* cells.
+    ``('fog', {'map': name, 'x': ..., 'y': ..., 'w': ..., 'h': ..., 'bits': ...})``
+      The cells in this rectangle changed; *bits* is the base64
+      encoded ``FogMask.region()``.
+    ``('cursor', {'map': name, 'x': ..., 'y': ..., 'radius': ...})``
+      The GM's cursor moved.
+
+    Parameters
+    ----------
+    library : tiles.MapLibrary
+      Provides the sizes of the maps.
+    cell_size : int
+      Size of each fog cell, in map pixels.
+
+    """
+    brush_radius = BRUSH_RADIUS
+    active_map = None
+
+    def __init__(self, library, cell_size=CELL_SIZE):
+        self.library = library
+        self.cell_size = cell_size
+        self.cursor = (0, 0)
+        self._masks = {}
+        self._subscribers = set()
+        self._lock = threading.RLock()
+
+    def mask(self, name):
+        """The fog mask for map *name*, all hidden to start with."""
+        with self._lock:
+            mask = self._masks.get(name)
+            if mask is None:
+                info = self.library.info(name)
+                mask = FogMask(-(-info['width'] // self.cell_size),
+                               -(-info['height'] // self.cell_size))
+                self._masks[name] = mask
+            return mask
+
+    def subscribe(self):
+        """Start receiving events; returns a queue to read them from."""
+        events = queue.SimpleQueue()
+        with self._lock:
+            self._subscribers.add(events)
+            # Bring the new subscriber up to date
+            for event in self.current_events():
+                events.put(event)
+        return events
+
+    def unsubscribe(self, events):
+        with self._lock:
+            self._subscribers.discard(events)
+
+    def _publish(self, event, data):
+        for events in list(self._subscribers):
+            events.put((event, data))
+
+    def _fog_event(self, name, x, y, width, height):
+        bits = self.mask(name).region(x, y, width, height)
+        return ('fog', {'map': name, 'x': x, 'y': y, 'w': width, 'h': height,
+                        'bits': base64.b64encode(bits).decode('ascii')})
+
+    def _cursor_event(self):
+        x, y = self.cursor
+        return ('cursor', {'map': self.active_map, 'x': x, 'y': y,
+                           'radius': self.brush_radius})
+
+    def current_events(self):
+        """Events that describe the whole current state."""
+        name = self.active_map
+        if name is None:
+            return []
+        mask = self.mask(name)
+        return [('map', {'map': name, 'cell_size': self.cell_size,
+                         'w': mask.width, 'h': mask.height}),
+                self._fog_event(name, 0, 0, mask.width, mask.height),
+                self._cursor_event()]
+
+    def show(self, name):
+        """Show map *name* on the displays.
+
+        The map is sliced into tiles first if needed, which can take
+        a while, so don't call this from the event loop.
+
+        """
+        # Slice the map without holding up other fog updates
+        self.library.info(name)
+        with self._lock:
+            mask = self.mask(name)
+            self.active_map = name
+            self.cursor = (mask.width // 2, mask.height // 2)
+            for event in self.current_events():
+                self._publish(*event)
+
+    def update(self, x, y, radius=None, revealed=True, name=None):
+        """Reveal (or hide) a circle of cells on a map.
+
+        Parameters
+        ----------
+        x, y : int
+          Cell at the center of the circle.
+        radius : int
+          Radius in cells; by default ``brush_radius``.
+        revealed : bool
+          Whether to reveal or hide the cells.
+        name : str
+          Which map to update; by default the one being shown.
+
+        Returns
+        -------
+        changed : tuple
+          Bounding box of the changed cells, or None.
+
+        """
+        radius = radius if radius is not None else self.brush_radius
+        with self._lock:
+            name = name if name is not None else self.active_map
+            if name is None:
+                return None
+            changed = self.mask(name).update_circle(x, y, radius, revealed=revealed)
+            if changed is not None:
+                self._publish(*self._fog_event(name, *changed))
+            return changed
+
+    def reset(self, revealed=False, name=None):
+        """Hide (or reveal) all of a map."""
+        with self._lock:
+            name = name if name is not None else self.active_map
+            if name is None:
+                return None
+            changed = self.mask(name).fill(revealed=revealed)
+            if changed is not None:
+                self._publish(*self._fog_event(name, *changed))
+            return changed
+
+    def move_cursor(self, dx, dy):
+        """Move the GM's cursor by (*dx*, *dy*) cells."""
+        with self._lock:
+            if self.active_map is None:
+                return
+            mask = self.mask(self.active_map)
+            x, y = self.cursor
+            self.cursor = (min(max(x + dx, 0), mask.width - 1),
+                           min(max(y + dy, 0), mask.height - 1))
+            self._publish(*self._cursor_event())
+
+    def reveal(self):
+        """Reveal the cells around the GM's cursor."""
+        return self.update(*self.cursor, revealed=True)
+
+    def hide(self):
+        """Cover up the cells around the GM's cursor again."""
+        return self.update(*self.cursor, revealed=False)
+
+    def do_action(self, action):
+        """Carry out one of the numberpad ``FOG_ACTIONS``."""
+        method, args = FOG_ACTIONS[action]
+        return getattr(self, method)(*args)
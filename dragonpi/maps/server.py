@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# This file is part of DragonPi.
+#
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Serve maps and their tiles to a web browser.
+
+``/``
+  The map viewer.
+``/maps``
+  JSON list of the available maps.
+``/maps/<name>``
+  JSON description of a map's tile pyramid (see
+  ``tiles.build_pyramid()``).
+``/tiles/<digest>/<level>/<x>_<y>.jpg``
+  One tile. Since the digest changes with the map, tiles are sent
+  with an ETag and marked as immutable, so the browser only ever
+  fetches each one once.
+``/events``
+  Server-sent events stream of the map being shown and changes to
+  its fog-of-war (see ``fog.FogBoard``).
+
+"""
+
+import logging
+log = logging.getLogger(__name__)
+import argparse
+import errno
+import json
+import mmap
+import os
+import queue
+import re
+import threading
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+from .fog import FogBoard
+from .tiles import MapLibrary, MapError, MAPS_DIR, CACHE_DIR
+
+THIS_DIR = os.path.abspath(os.path.dirname(__file__))
+VIEWER_FILE = os.path.join(THIS_DIR, 'viewer.html')
+PORT = 8080
+
+tile_re = re.compile(r'^/tiles/([0-9a-f]{16})/(\d+)/(\d+)_(\d+)\.jpg$')
+map_re = re.compile(r'^/maps/([^/]+)$')
+
+
+class EmptyTileError(FileNotFoundError):
+    """A tile file exists, but has nothing in it."""
+
+
+class TileCache():
+    """Keep recently used tiles open as memory-mapped files.
+
+    The kernel's page cache holds the tile data, so sending a tile
+    that was used recently doesn't need any reads or copies in
+    python.
+
+    Parameters
+    ----------
+    max_open : int
+      How many tiles to keep mapped at once.
+
+    """
+    max_open = 512
+
+    def __init__(self, max_open=None):
+        if max_open is not None:
+            self.max_open = max_open
+        self._maps = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, filename):
+        """Return the memory-mapped contents of *filename*.
+
+        Raises ``FileNotFoundError`` if the tile does not exist, or
+        ``EmptyTileError`` if it is empty.
+
+        """
+        with self._lock:
+            mapped = self._maps.get(filename)
+            if mapped is not None:
+                self._maps.move_to_end(filename)
+                return mapped
+        with open(filename, mode='rb') as fp:
+            # Empty files can't be mapped
+            if os.fstat(fp.fileno()).st_size == 0:
+                raise EmptyTileError(errno.ENOENT, "Empty tile", filename)
+            mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        with self._lock:
+            self._maps[filename] = mapped
+            # Forget the oldest tiles; the mappings are closed once
+            # any requests still sending them are done
+            while len(self._maps) > self.max_open:
+                self._maps.popitem(last=False)
+        return mapped
+
+
+class MapRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'DragonPi'
+    keepalive_interval = 15
+
+    def log_message(self, format, *args):
+        log.debug("%s - %s", self.address_string(), format % args)
+
+    def send_body(self, body, content_type, cache_control='no-cache', etag=None):
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', cache_control)
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def send_json(self, data):
+        self.send_body(json.dumps(data).encode('utf8'), 'application/json')
+
+    def do_GET(self):
+        path = unquote(urlsplit(self.path).path)
+        library = self.server.library
+        try:
+            if path == '/':
+                with open(VIEWER_FILE, mode='rb') as fp:
+                    self.send_body(fp.read(), 'text/html; charset=utf-8')
+            elif path == '/events':
+                self.send_events()
+            elif path == '/maps':
+                self.send_json(library.names())
+            elif map_re.match(path):
+                self.send_json(library.info(map_re.match(path).group(1)))
+            elif tile_re.match(path):
+                self.send_tile(*tile_re.match(path).groups())
+            else:
+                self.send_error(HTTPStatus.NOT_FOUND)
+        except MapError as e:
+            self.send_error(HTTPStatus.NOT_FOUND, str(e))
+
+    do_HEAD = do_GET
+
+    def send_tile(self, digest, level, x, y):
+        etag = f'"{digest}-{level}-{x}-{y}"'
+        if etag in self.headers.get('If-None-Match', ''):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        library = self.server.library
+        filename = library.tile_path(digest, int(level), int(x), int(y))
+        try:
+            try:
+                tile = self.server.tiles.get(filename)
+            except EmptyTileError:
+                # The pyramid was damaged, so slice the map again
+                library.rebuild(digest)
+                tile = self.server.tiles.get(filename)
+        except FileNotFoundError:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        self.send_body(memoryview(tile), 'image/jpeg', etag=etag,
+                       cache_control='public, max-age=31536000, immutable')
+
+
+    def send_events(self):
+        fog = self.server.fog
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.close_connection = True
+        if self.command == 'HEAD':
+            return
+        events = fog.subscribe()
+        try:
+            while True:
+                try:
+                    event = events.get(timeout=self.keepalive_interval)
+                except queue.Empty:
+                    self.wfile.write(b': keepalive\n\n')
+                    self.wfile.flush()
+                    continue
+                # Send everything that has piled up in one go
+                chunks = []
+                while event is not None:
+                    name, data = event
+                    chunks.append(f'event: {name}\ndata: {json.dumps(data)}\n\n')
+                    try:
+                        event = events.get_nowait()
+                    except queue.Empty:
+                        event = None
+                self.wfile.write(''.join(chunks).encode('utf8'))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            fog.unsubscribe(events)
+
+
+class MapServer(ThreadingHTTPServer):
+    """HTTP server for the map viewer and tiles.
+
+    Parameters
+    ----------
+    address : tuple
+      ``(host, port)`` to listen on.
+    library : tiles.MapLibrary
+      The maps to serve.
+    tiles : TileCache
+      Keeps recently used tiles mapped into memory.
+    fog : fog.FogBoard
+      Fog-of-war to stream to the displays.
+
+    """
+    daemon_threads = True
+
+    def __init__(self, address, library=None, tiles=None, fog=None):
+        self.library = library if library is not None else MapLibrary()
+        self.tiles = tiles if tiles is not None else TileCache()
+        self.fog = fog if fog is not None else FogBoard(self.library)
+        super().__init__(address, MapRequestHandler)
+
+    def prepare_maps(self):
+        """Slice any new maps into tiles in a background thread."""
+        thread = threading.Thread(target=self.library.prepare, name='MapPrepare',
+                                  daemon=True)
+        thread.start()
+        return thread
+
+    def run_in_thread(self):
+        """Serve requests from a daemon thread."""
+        self.prepare_maps()
+        thread = threading.Thread(target=self.serve_forever, name='MapServer',
+                                  daemon=True)
+        thread.start()
+        return thread
+
+
+def parse_args():
+    """Parse the command-line arguments and return the options."""
+    parser = argparse.ArgumentParser(description="Serve DragonPi maps to a web browser.")
+    parser.add_argument('-p', '--port', type=int, default=PORT, help="Port to listen on")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="Address to listen on; 0.0.0.0 for other devices too")
+    parser.add_argument('-m', '--maps-dir', default=MAPS_DIR, help="Directory of map images")
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help="Where to keep the tiles")
+    parser.add_argument('-d', '--debug', action='store_true', help="Spit out verbose logging")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    library = MapLibrary(maps_dir=args.maps_dir, cache_dir=args.cache_dir)
+    server = MapServer((args.host, args.port), library=library)
+    server.prepare_maps()
+    log.info("Serving maps on http://%s:%d/", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+# This file is part of DragonPi.
+#
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Slice map images into a pyramid of tiles, cached on disk.
+
+Level 0 of the pyramid fits the whole map into one tile, and each
+following level doubles the resolution, up to the full size of the
+image at the last level. Tiles are stored as
+``<cache_dir>/<digest>/<level>/<x>_<y>.jpg``, where the digest
+changes whenever the map image does, so a tile's contents never
+change once written.
+
+"""
+
+import logging
+log = logging.getLogger(__name__)
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+THIS_DIR = os.path.abspath(os.path.dirname(__file__))
+MAPS_DIR = os.path.join(THIS_DIR, 'images/')
+CACHE_HOME = os.environ.get('XDG_CACHE_HOME',
+                            os.path.join(os.path.expanduser('~'), '.cache'))
+CACHE_DIR = os.path.join(CACHE_HOME, 'dragonpi', 'tiles')
+TILE_SIZE = 256
+TILE_QUALITY = 85
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.gif', '.bmp', '.tif', '.tiff')
+INFO_FILE = 'info.json'
+
+digest_re = re.compile(r'^[0-9a-f]{16}$')
+
+
+class MapError(ValueError):
+    """A map could not be found or sliced into tiles."""
+
+
+def map_digest(image_file):
+    """Identify a version of a map image.
+
+    Based on the file's name, size and modification time, so it is
+    cheap even for huge images.
+
+    """
+    stat = os.stat(image_file)
+    key = f'{os.path.basename(image_file)}:{stat.st_size}:{stat.st_mtime_ns}'
+    return hashlib.sha1(key.encode('utf8')).hexdigest()[:16]
+
+
+def num_levels(width, height, tile_size=TILE_SIZE):
+    """How many pyramid levels are needed for an image of this size."""
+    levels = 1
+    size = max(width, height)
+    while size > tile_size:
+        # Each level down halves the size, rounding up
+        size = (size + 1) // 2
+        levels += 1
+    return levels
+
+
+def tile_path(tile_dir, level, x, y):
+    return os.path.join(tile_dir, str(level), f'{x}_{y}.jpg')
+
+
+def build_pyramid(image_file, tile_dir, tile_size=TILE_SIZE, quality=TILE_QUALITY):
+    """Slice *image_file* into tiles and save them in *tile_dir*.
+
+    The tiles are written to a temporary directory first, which is
+    then renamed, so *tile_dir* either holds a complete pyramid or
+    does not exist.
+
+    Returns
+    -------
+    info : dict
+      Description of the pyramid, as also saved in ``info.json``.
+
+    """
+    if Image is None:
+        raise MapError(f"Slicing {image_file} into tiles needs Pillow.")
+    log.info("Slicing %s into tiles", image_file)
+    tmp_dir = f'{tile_dir}.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    try:
+        img = Image.open(image_file)
+        img.load()
+    except (OSError, Image.DecompressionBombError) as e:
+        # Pillow refuses images over ``Image.MAX_IMAGE_PIXELS`` (about
+        # 179 MP by default) as possible decompression bombs
+        raise MapError(f"Could not read {image_file}: {e}") from e
+    img = img.convert('RGB')
+    width, height = img.size
+    levels = num_levels(width, height, tile_size)
+    # Work from the full size image down, halving it each time
+    for level in reversed(range(levels)):
+        level_width, level_height = img.size
+        os.makedirs(os.path.join(tmp_dir, str(level)))
+        for y in range(0, (level_height + tile_size - 1) // tile_size):
+            for x in range(0, (level_width + tile_size - 1) // tile_size):
+                box = (x * tile_size, y * tile_size,
+                       min((x + 1) * tile_size, level_width),
+                       min((y + 1) * tile_size, level_height))
+                img.crop(box).save(tile_path(tmp_dir, level, x, y), 'JPEG',
+                                   quality=quality)
+        if level > 0:
+            img = img.reduce(2)
+    info = {
+        'name': os.path.basename(image_file),
+        'digest': os.path.basename(tile_dir),
+        'width': width,
+        'height': height,
+        'tile_size': tile_size,
+        'levels': levels,
+    }
+    with open(os.path.join(tmp_dir, INFO_FILE), mode='w') as fp:
+        json.dump(info, fp)
+    os.replace(tmp_dir, tile_dir)
+    return info
+
+
+class MapLibrary():
+    """The map images available to show, and their tile pyramids.
+
+    Parameters
+    ----------
+    maps_dir : str
+      Directory holding the map images.
+    cache_dir : str
+      Directory in which to keep the tile pyramids.
+    tile_size : int
+      Width and height of each tile, in pixels.
+
+    """
+    def __init__(self, maps_dir=MAPS_DIR, cache_dir=CACHE_DIR, tile_size=TILE_SIZE):
+        self.maps_dir = maps_dir
+        self.cache_dir = cache_dir
+        self.tile_size = tile_size
+        self._infos = {}
+        # Only slice one map at a time, they can be big
+        self._build_lock = threading.Lock()
+
+    def names(self):
+        """List the map images, sorted by name."""
+        try:
+            files = os.listdir(self.maps_dir)
+        except FileNotFoundError:
+            return []
+        return sorted(f for f in files if f.lower().endswith(IMAGE_EXTENSIONS))
+
+    def image_file(self, name):
+        if name not in self.names():
+            raise MapError(f"Unknown map: {name}")
+        return os.path.join(self.maps_dir, name)
+
+    def tile_dir(self, digest):
+        if not digest_re.match(digest):
+            raise MapError(f"Invalid digest: {digest}")
+        return os.path.join(self.cache_dir, digest)
+
+    def info(self, name):
+        """Describe the tile pyramid for map *name*, slicing the map
+        first if there isn't one cached yet."""
+        image_file = self.image_file(name)
+        digest = map_digest(image_file)
+        info = self._infos.get(digest)
+        if info is not None:
+            return info
+        tile_dir = self.tile_dir(digest)
+        with self._build_lock:
+            try:
+                with open(os.path.join(tile_dir, INFO_FILE), mode='r') as fp:
+                    info = json.load(fp)
+            except FileNotFoundError:
+                info = build_pyramid(image_file, tile_dir, tile_size=self.tile_size)
+        self._infos[digest] = info
+        return info
+
+    def rebuild(self, digest):
+        """Slice a map again after its tiles turned out to be damaged,
+        e.g. by a power cut while they were being written."""
+        tile_dir = self.tile_dir(digest)
+        with self._build_lock:
+            info = self._infos.pop(digest, None)
+            if info is None:
+                try:
+                    with open(os.path.join(tile_dir, INFO_FILE), mode='r') as fp:
+                        info = json.load(fp)
+                except (OSError, ValueError):
+                    pass
+            log.warning("Removing damaged tiles %s", digest)
+            shutil.rmtree(tile_dir, ignore_errors=True)
+        if info is not None:
+            self.info(info['name'])
+
+    def tile_path(self, digest, level, x, y):
+        """Where the tile would be saved (whether it exists or not)."""
+        return tile_path(self.tile_dir(digest), level, x, y)
+
+    def prepare(self):
+        """Make sure every map has been sliced into tiles, and remove
+        pyramids of maps that have since changed or been removed."""
+        digests = set()
+        for name in self.names():
+            try:
+                digests.add(self.info(name)['digest'])
+            except MapError as e:
+                log.error("Could not prepare map: %s", e)
+        # Nothing is being sliced while the lock is held, so even
+        # leftover temporary directories can go
+        with self._build_lock:
+            # Also keep maps that were sliced since they were listed
+            digests.update(self._infos.keys())
+            try:
+                cached = os.listdir(self.cache_dir)
+            except FileNotFoundError:
+                cached = []
+            for entry in cached:
+                if entry not in digests:
+                    log.info("Removing stale tiles %s", entry)
+                    shutil.rmtree(os.path.join(self.cache_dir, entry), ignore_errors=True)
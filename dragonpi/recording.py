@@ -0,0 +1,117 @@
+# This file is part of DragonPi.
+#
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Record numberpad and LCD button events to a compact binary file.
+
+A recording starts with ``MAGIC``, followed by one record per
+event. Each record is a ``RECORD`` header (monotonic nanoseconds since
+the recording started, event source, payload length) followed by the
+payload: the key spec (see ``keymap.key_to_spec()``) for numberpad
+keys, or the button number for LCD buttons.
+
+"""
+
+import logging
+log = logging.getLogger(__name__)
+import struct
+import threading
+import time
+
+from .keymap import key_to_spec
+
+MAGIC = b'DPREC\x01'
+RECORD = struct.Struct('<QBB')
+
+# Event sources
+KEY = 1
+BUTTON = 2
+
+
+class EventRecorder():
+    """Write events from several threads to one recording file.
+
+    Parameters
+    ----------
+    filename : str
+      Path to the new recording. An existing file is overwritten.
+
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._fp = open(filename, mode='wb')
+        self._fp.write(MAGIC)
+        self._lock = threading.Lock()
+        self._start = time.monotonic_ns()
+        log.info("Recording events to %s", filename)
+
+    def record(self, source, payload):
+        timestamp = time.monotonic_ns() - self._start
+        with self._lock:
+            if self._fp.closed:
+                # Events can still trickle in while shutting down
+                return
+            self._fp.write(RECORD.pack(timestamp, source, len(payload)))
+            self._fp.write(payload)
+            self._fp.flush()
+
+    def record_key(self, key):
+        """Record a key pressed on the numberpad."""
+        self.record(KEY, key_to_spec(key).encode('utf8'))
+
+    def record_button(self, button):
+        """Record a button pressed on the LCD plate."""
+        self.record(BUTTON, bytes([button]))
+
+    def close(self):
+        with self._lock:
+            self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_recording(filename):
+    """Iterate over the events in a recording.
+
+    Yields
+    ------
+    timestamp : int
+      Nanoseconds since the start of the recording.
+    source : int
+      Either ``KEY`` or ``BUTTON``.
+    value
+      The key spec (str) or button number (int).
+
+    """
+    with open(filename, mode='rb') as fp:
+        if fp.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{filename} is not a DragonPi recording.")
+        while True:
+            header = fp.read(RECORD.size)
+            if len(header) < RECORD.size:
+                # A truncated record means the program was killed
+                break
+            timestamp, source, length = RECORD.unpack(header)
+            payload = fp.read(length)
+            if len(payload) < length:
+                break
+            if source == KEY:
+                value = payload.decode('utf8')
+            else:
+                value = payload[0]
+            yield timestamp, source, value
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# This file is part of DragonPi.
+#
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Replay a recorded session against fake audio and LCD backends.
+
+Events are fed back one at a time in the order they were recorded,
+so a replay is deterministic. The time taken to handle each event is
+reported, along with the CPU time used by the whole replay.
+
+"""
+
+import logging
+log = logging.getLogger(__name__)
+import argparse
+import statistics
+import time
+
+from .dndmusic import MusicListener
+from .fakevlc import FakeInstance
+from .keymap import parse_key
+from .lcdmenu import LCDMenu, DummyLCD
+from .recording import read_recording, KEY, BUTTON
+from .run_game import menu_entries
+
+
+def parse_args():
+    """Parse the command-line arguments and return the options."""
+    parser = argparse.ArgumentParser(description="Replay a recorded DragonPi session.")
+    parser.add_argument('recording', help="File created with ``dragonpi --record``")
+    parser.add_argument('-s', '--speed', type=float, default=1.,
+                        help="Replay speed relative to the recording; 0 replays "
+                        "as fast as possible")
+    parser.add_argument('-k', '--keymap', help="Keymap file to use for numberpad keys")
+    parser.add_argument('-d', '--debug', action='store_true', help="Spit out verbose logging")
+    return parser.parse_args()
+
+
+def replay(events, music, menu, speed=1.):
+    """Dispatch recorded events and time how long each one takes.
+
+    Parameters
+    ----------
+    events
+      Iterable of ``(timestamp, source, value)`` tuples as given by
+      ``read_recording()``.
+    music : MusicListener
+      Receives the numberpad key events.
+    menu : LCDMenu
+      Receives the LCD button events.
+    speed : float
+      How much faster than real-time to replay. If 0, events are
+      dispatched back-to-back.
+
+    Returns
+    -------
+    latencies : dict
+      Handler times, in seconds, for each event source.
+
+    """
+    latencies = {KEY: [], BUTTON: []}
+    start = time.monotonic()
+    for timestamp, source, value in events:
+        # Wait until the event is due
+        if speed > 0:
+            delay = start + timestamp / 1e9 / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        t0 = time.perf_counter()
+        if source == KEY:
+            music.on_press(parse_key(value))
+        elif source == BUTTON:
+            menu.press(value)
+        else:
+            log.warning("Unknown event source %d", source)
+            continue
+        latencies[source].append(time.perf_counter() - t0)
+    return latencies
+
+
+def summarize(name, latencies):
+    """Format a one-line summary of handler latencies."""
+    if not latencies:
+        return f"{name}: no events"
+    ms = sorted(l * 1000 for l in latencies)
+    p95 = ms[min(len(ms) - 1, int(0.95 * len(ms)))]
+    return (f"{name}: {len(ms)} events, mean {statistics.mean(ms):.2f} ms, "
+            f"median {statistics.median(ms):.2f} ms, p95 {p95:.2f} ms, "
+            f"max {ms[-1]:.2f} ms")
+
+
+def main():
+    args = parse_args()
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG)
+    # Prepare the fake backends
+    music = MusicListener(keymap=args.keymap, instance=FakeInstance())
+    menu = LCDMenu(lcd=DummyLCD())
+    menu.add_entries(*menu_entries(music.engine))
+    menu.refresh_text()
+    # Replay the recording
+    wall_start = time.monotonic()
+    cpu_start = time.process_time()
+    latencies = replay(read_recording(args.recording), music, menu, speed=args.speed)
+    cpu_time = time.process_time() - cpu_start
+    wall_time = time.monotonic() - wall_start
+    # Report the results
+    print(summarize("Numberpad", latencies[KEY]))
+    print(summarize("LCD buttons", latencies[BUTTON]))
+    print(f"Wall time: {wall_time:.2f} s, CPU time: {cpu_time:.2f} s "
+          f"({100 * cpu_time / max(wall_time, 1e-9):.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
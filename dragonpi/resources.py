@@ -0,0 +1,200 @@
+# This file is part of DragonPi.
+#
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Keep an eye on the resources used over a long session.
+
+The audio engine counts the VLC players and media it holds in a
+``ResourceLedger``, and complains as soon as a cue leaves more of
+them alive than it should. A ``ResourceMonitor`` checks the process's
+memory and each thread's CPU time every so often, which is cheap
+enough to leave running during a game.
+
+"""
+
+import logging
+log = logging.getLogger(__name__)
+import os
+import threading
+import time
+from collections import Counter
+
+STATM_FILE = '/proc/self/statm'
+TASK_DIR = '/proc/self/task'
+RSS_LIMIT = 256 * 1024 * 1024
+CPU_LIMIT = 0.5
+MONITOR_INTERVAL = 60.
+
+
+class ResourceLedger():
+    """Count live objects (e.g. VLC players) by kind.
+
+    Parameters
+    ----------
+    limits : dict
+      Maximum number of live objects of each kind; a warning is
+      logged the first time a limit is exceeded.
+
+    """
+    def __init__(self, limits=None):
+        self.limits = dict(limits or {})
+        self.live = Counter()
+        self.total = Counter()
+        self._warned = set()
+        self._lock = threading.Lock()
+
+    def acquire(self, kind):
+        """Note that a new object of *kind* was created."""
+        limit = self.limits.get(kind)
+        with self._lock:
+            self.live[kind] += 1
+            self.total[kind] += 1
+            count = self.live[kind]
+            warn = limit is not None and count > limit and kind not in self._warned
+            if warn:
+                self._warned.add(kind)
+        if warn:
+            log.warning("%d live %s objects, more than the limit of %d; "
+                        "something is not being released", count, kind, limit)
+
+    def release(self, kind):
+        """Note that an object of *kind* was released."""
+        with self._lock:
+            self.live[kind] -= 1
+            if self.live[kind] <= self.limits.get(kind, 0):
+                self._warned.discard(kind)
+
+    def counts(self):
+        """The number of live objects of each kind."""
+        with self._lock:
+            return dict(self.live)
+
+
+def read_rss(statm_file=STATM_FILE):
+    """Resident memory of this process, in bytes, or None if unknown."""
+    try:
+        with open(statm_file, mode='r') as fp:
+            resident_pages = int(fp.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def read_thread_cpu(task_dir=TASK_DIR):
+    """CPU time (user + system), in seconds, used by each thread.
+
+    Returns
+    -------
+    dict
+      Maps each thread's native ID to its CPU time.
+
+    """
+    ticks = os.sysconf('SC_CLK_TCK')
+    cpu = {}
+    try:
+        tids = os.listdir(task_dir)
+    except OSError:
+        return cpu
+    for tid in tids:
+        try:
+            with open(os.path.join(task_dir, tid, 'stat'), mode='r') as fp:
+                stat = fp.read()
+        except OSError:
+            # The thread has finished
+            continue
+        # The name in brackets may contain spaces, so skip past it
+        fields = stat[stat.rindex(')') + 2:].split()
+        cpu[int(tid)] = (int(fields[11]) + int(fields[12])) / ticks
+    return cpu
+
+
+def thread_names():
+    """Map native thread IDs to python thread names."""
+    return {t.native_id: t.name for t in threading.enumerate()}
+
+
+class ResourceMonitor(threading.Thread):
+    """Periodically check memory and CPU use in the background.
+
+    Parameters
+    ----------
+    ledger : ResourceLedger
+      Live object counts to report alongside, e.g.
+      ``AudioEngine.resources``.
+    interval : float
+      Seconds between checks.
+    rss_limit : int
+      Warn if the resident memory grows beyond this, in bytes.
+    cpu_limit : float
+      Warn if a thread uses more than this fraction of a CPU core
+      between two checks.
+
+    """
+    def __init__(self, ledger=None, interval=MONITOR_INTERVAL, rss_limit=RSS_LIMIT,
+                 cpu_limit=CPU_LIMIT):
+        super().__init__(name='ResourceMonitor', daemon=True)
+        self.ledger = ledger
+        self.interval = interval
+        self.rss_limit = rss_limit
+        self.cpu_limit = cpu_limit
+        self.last_sample = None
+        self._last_cpu = None
+        self._last_time = None
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def sample(self):
+        """Take a measurement, and warn if anything is over budget.
+
+        Returns
+        -------
+        dict
+          ``rss`` in bytes, ``cpu`` as the fraction of a core used
+          by each thread since the last sample, and the ledger's
+          ``counts``.
+
+        """
+        now = time.monotonic()
+        cpu = read_thread_cpu()
+        names = thread_names()
+        usage = {}
+        if self._last_cpu is not None and now > self._last_time:
+            elapsed = now - self._last_time
+            for tid, seconds in cpu.items():
+                name = names.get(tid, str(tid))
+                usage[name] = (seconds - self._last_cpu.get(tid, 0)) / elapsed
+        self._last_cpu = cpu
+        self._last_time = now
+        sample = {
+            'rss': read_rss(),
+            'cpu': usage,
+            'counts': self.ledger.counts() if self.ledger is not None else {},
+        }
+        self.last_sample = sample
+        log.debug("Resources: %s", sample)
+        # Check the budgets
+        if sample['rss'] is not None and sample['rss'] > self.rss_limit:
+            log.warning("Using %.1f MB of memory, more than the limit of %.1f MB",
+                        sample['rss'] / 2**20, self.rss_limit / 2**20)
+        for name, fraction in usage.items():
+            if fraction > self.cpu_limit:
+                log.warning("Thread %s used %.0f%% CPU", name, fraction * 100)
+        return sample
+
+    def run(self):
+        self.sample()
+        while not self._stop_event.wait(self.interval):
+            self.sample()
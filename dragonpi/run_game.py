@@ -3,31 +3,89 @@
 import logging
 log = logging.getLogger(__name__)
 import argparse
+import os
 from threading import Thread
 
-from dragonpi.dndmusic import MusicListener
-from dragonpi.lcdmenu import LCDMenu, AudioOutput, Greeting
+from dragonpi.audio import AudioEngine, find_output_devices
+from dragonpi.control import ControlServer, blocking_runner, SOCKET_FILE
+from dragonpi.display import open_display
+from dragonpi.dndmusic import MusicListener, MUSIC_DIR
+from dragonpi.idle import IdleManager, IDLE_TIMEOUT
+from dragonpi.lcdmenu import (LCDMenu, AudioOutput, Greeting, MenuGroup, Volume,
+                              TrackBrowser)
+from dragonpi.recording import EventRecorder
+from dragonpi.resources import ResourceMonitor, MONITOR_INTERVAL, RSS_LIMIT
+from dragonpi.snapshot import SnapshotWriter, read_snapshot, SNAPSHOT_FILE
+from dragonpi.trace import tracer
 
 def parse_args():
     """Parse the command-line arguments and return the options."""
     parser = argparse.ArgumentParser(description="Launch the DragonPi D&D game helper.")
     # Add command-line arguments
     parser.add_argument('-d', '--debug', action='store_true', help="Spit out verbose logging")
+    parser.add_argument('-k', '--keymap', help="TOML or JSON file with numberpad key "
+                        "assignments; reloaded automatically when it changes")
+    parser.add_argument('-r', '--record', metavar='FILE', help="Record numberpad and "
+                        "LCD button events to FILE for use with dragonpi-replay")
+    parser.add_argument('-t', '--trace', metavar='FILE', help="Trace music, LCD and I2C "
+                        "activity; send SIGUSR1 to write Chrome trace JSON to FILE")
+    parser.add_argument('-i', '--idle-timeout', type=float, default=IDLE_TIMEOUT,
+                        help="Seconds without activity before releasing the paused "
+                        "audio player and slowing down the LCD")
+    parser.add_argument('-s', '--snapshot', default=SNAPSHOT_FILE, metavar='FILE',
+                        help="Where to save the playback state for recovering "
+                        "after a crash")
+    parser.add_argument('--no-restore', action='store_true',
+                        help="Don't resume the playback state saved in the snapshot")
+    parser.add_argument('-a', '--asyncio', action='store_true',
+                        help="Run everything on a single asyncio event loop "
+                        "instead of separate threads")
+    parser.add_argument('-c', '--control', nargs='?', const=SOCKET_FILE, metavar='SOCKET',
+                        help="Accept commands (e.g. from dragonpi-ctl) on a Unix "
+                        f"domain socket (default {SOCKET_FILE})")
+    parser.add_argument('--control-port', type=int, metavar='PORT',
+                        help="Also accept commands on this localhost TCP port")
+    parser.add_argument('-D', '--display', action='append', default=[], metavar='SPEC',
+                        help="Mirror the menu on another LCD, e.g. backpack@0x21:20x4; "
+                        "may be given more than once")
+    parser.add_argument('--audio-devices', nargs=3, metavar=('AUTO', 'ANALOG', 'HDMI'),
+                        help="ALSA devices for the audio outputs (see aplay -L); "
+                        "by default they are looked up with aplay")
+    parser.add_argument('-m', '--maps-port', type=int, metavar='PORT',
+                        help="Serve the map viewer on this port")
+    parser.add_argument('--rss-limit', type=float, default=RSS_LIMIT / 2**20, metavar='MB',
+                        help="Warn if the program uses more memory than this")
+    parser.add_argument('--monitor-interval', type=float, default=MONITOR_INTERVAL,
+                        metavar='SECONDS', help="How often to check memory and CPU use")
     # Parse the actual command line arguments
     args = parser.parse_args()
     return args
 
 
-def start_music():
-    # Load the listener for doing music keypresses
-    with MusicListener() as music:
+def start_music(music):
+    # Run the listener for doing music keypresses
+    with music:
         music.join()
 
 
-def start_lcd():
-    lcdmenu = LCDMenu()
-    entries = [Greeting(), AudioOutput()]
-    lcdmenu.add_entries(*entries)
+def menu_entries(engine):
+    """Build the top level of the LCD menu."""
+    audio_entries = lambda: [AudioOutput(engine), Volume(engine),
+                             TrackBrowser(engine, MUSIC_DIR)]
+    return [Greeting(), MenuGroup("Audio", audio_entries)]
+
+
+def engine_status(engine):
+    """Status lines about the music, for displays with room for them."""
+    song = os.path.basename(engine.song_file) if engine.song_file else "Stopped"
+    state = "Paused" if engine.paused else f"Volume {engine.volume:.0f}%"
+    return (song, state)
+
+
+def start_lcd(engine, recorder=None, idle=None, displays=()):
+    lcdmenu = LCDMenu(recorder=recorder, idle=idle, displays=displays,
+                      status=lambda: engine_status(engine))
+    lcdmenu.add_entries(*menu_entries(engine))
     lcdmenu.join()
 
 
@@ -36,13 +94,82 @@ def main():
     # Prepare logging if requested
     if args.debug:
         logging.basicConfig(level=logging.INFO)
-    # Start the music handler
-    music_thread = Thread(target=start_music)
-    music_thread.start()
-    # Start the LCD menu
-    lcd_thread = Thread(target=start_lcd)
-    lcd_thread.start()
-
+    # Enable tracing if requested
+    if args.trace:
+        tracer.enabled = True
+        tracer.install_signal_handler(args.trace)
+    # Record events if requested
+    recorder = EventRecorder(args.record) if args.record else None
+    # Prepare the audio engine
+    idle = IdleManager(timeout=args.idle_timeout)
+    output_devices = args.audio_devices or find_output_devices()
+    engine = AudioEngine(idle=idle, output_devices=output_devices)
+    # Pick up where we left off, e.g. after a crash
+    state = None if args.no_restore else read_snapshot(args.snapshot)
+    snapshot_writer = SnapshotWriter(engine, filename=args.snapshot)
+    # Watch for leaks over a long session
+    monitor = ResourceMonitor(engine.resources, interval=args.monitor_interval,
+                              rss_limit=args.rss_limit * 2**20)
+    # Extra displays that mirror the LCD menu
+    displays = [open_display(spec) for spec in args.display]
+    # Serve maps to the display's browser
+    fog = None
+    if args.maps_port is not None:
+        from dragonpi.maps.server import MapServer
+        map_server = MapServer(('127.0.0.1', args.maps_port))
+        map_server.run_in_thread()
+        fog = map_server.fog
+    music = None
+    try:
+        if args.asyncio:
+            from dragonpi.runtime import AsyncRuntime
+            runtime = AsyncRuntime(engine, menu_entries, idle=idle, keymap=args.keymap,
+                                   recorder=recorder, snapshot_writer=snapshot_writer,
+                                   restore_state=state, control_socket=args.control,
+                                   control_port=args.control_port, fog=fog,
+                                   displays=displays,
+                                   status=lambda: engine_status(engine),
+                                   resource_monitor=monitor)
+            runtime.run()
+            return
+        if state is not None:
+            Thread(target=engine.restore, args=(state,), daemon=True).start()
+        snapshot_writer.start()
+        monitor.start()
+        # Start the music handler
+        music = MusicListener(engine=engine, keymap=args.keymap, recorder=recorder,
+                              fog=fog)
+        music_thread = Thread(target=start_music, args=(music,))
+        music_thread.start()
+        # Start the remote control server
+        if args.control is not None or args.control_port is not None:
+            control = ControlServer(music, blocking_runner(engine))
+            control.run_in_thread(socket_file=args.control, port=args.control_port)
+        # Start the LCD menu
+        lcd_thread = Thread(target=start_lcd, args=(engine,), daemon=True,
+                            kwargs=dict(recorder=recorder, idle=idle, displays=displays))
+        lcd_thread.start()
+        # Start counting down to idle
+        idle.touch()
+        # Run until the numberpad listener stops, e.g. on Ctrl-C
+        music_thread.join()
+    except KeyboardInterrupt:
+        log.info("Shutting down")
+    finally:
+        if music is not None:
+            music.stop()
+        # Don't lose the end of the recording
+        if recorder is not None:
+            recorder.close()
+        # Stop the background checks before letting go of VLC
+        idle.cancel()
+        monitor.stop()
+        if snapshot_writer.is_alive():
+            snapshot_writer.stop()
+            snapshot_writer.join()
+            # Remember what was playing
+            snapshot_writer.save(force=True)
+        engine.close()
 
 if __name__ == "__main__":
     main()
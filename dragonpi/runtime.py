@@ -0,0 +1,256 @@
+# This file is part of DragonPi.
+#
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Run DragonPi on a single asyncio event loop.
+
+This is an alternative to starting separate music and LCD threads
+(see ``run_game.main()``). Numberpad keys, LCD button scanning, fades
+and snapshots all become tasks and timers on one loop. The blocking
+LCD and I2C calls run on a one-thread executor, and the audio
+engine's operations are stepped through with ``asyncio.sleep()``
+instead of ``time.sleep()``.
+
+"""
+
+import logging
+log = logging.getLogger(__name__)
+import asyncio
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from .control import ControlServer
+from .dndmusic import MusicListener
+from .lcdmenu import LCDMenu
+
+
+class EngineProxy():
+    """Give blocking code (e.g. LCD menu items running on the executor)
+    access to an audio engine that is driven by the event loop.
+
+    The engine's blocking methods are replaced by ones that run the
+    same steps on the loop and wait for them to finish. Everything
+    else is passed through to the engine.
+
+    """
+    def __init__(self, engine, runtime):
+        self.engine = engine
+        self.runtime = runtime
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+
+    def _run(self, steps):
+        future = asyncio.run_coroutine_threadsafe(self.runtime.run_steps(steps),
+                                                  self.runtime.loop)
+        return future.result()
+
+    def play_song(self, *args, **kwargs):
+        self._run(self.engine.play_song_steps(*args, **kwargs))
+
+    def stop_music(self, *args, **kwargs):
+        self._run(self.engine.stop_music_steps(*args, **kwargs))
+
+    def toggle_pause(self):
+        self._run(self.engine.toggle_pause_steps())
+
+    def change_volume(self, delta_vol):
+        self._run(self.engine.change_volume_steps(delta_vol))
+
+    def set_output(self, *args, **kwargs):
+        self._run(self.engine.set_output_steps(*args, **kwargs))
+
+
+class AsyncMusicListener(MusicListener):
+    """A numberpad listener that hands keys over to the event loop
+    instead of acting on them in the listener's thread."""
+    def __init__(self, runtime, *args, **kwargs):
+        self.runtime = runtime
+        super().__init__(*args, **kwargs)
+
+    def handle_key(self, key):
+        self.runtime.loop.call_soon_threadsafe(self.runtime.keys.put_nowait, key)
+
+
+class AsyncRuntime():
+    """Runs the numberpad, audio engine and LCD menu on one event loop.
+
+    Parameters
+    ----------
+    engine : audio.AudioEngine
+      The engine that plays the music.
+    menu_entries
+      Called with the engine (wrapped in an ``EngineProxy``) to build
+      the top level LCD menu items.
+    idle : idle.IdleManager
+      Tracks activity; its countdown and callbacks are run on the
+      loop.
+    keymap : str
+      Optional keymap file for the numberpad.
+    recorder : recording.EventRecorder
+      Optional recorder for numberpad and LCD events.
+    snapshot_writer : snapshot.SnapshotWriter
+      If given, snapshots are saved periodically from the loop
+      instead of the writer's own thread.
+    restore_state : dict
+      Playback state to restore when starting up.
+    lcd
+      The LCD to use for the menu; by default the LCD plate.
+    control_socket : str
+      If given, accept commands on this Unix domain socket (see
+      ``control.ControlServer``).
+    control_port : int
+      If given, also accept commands on this localhost TCP port.
+    fog : maps.fog.FogBoard
+      Fog-of-war for the numberpad and control commands to update.
+    displays
+      Extra ``display.DisplayWriter`` instances to mirror the menu on.
+    status
+      Called to get extra status lines for the displays.
+    resource_monitor : resources.ResourceMonitor
+      If given, memory and CPU use are checked from the loop instead
+      of the monitor's own thread.
+
+    """
+    loop = None
+    keys = None
+
+    def __init__(self, engine, menu_entries, idle=None, keymap=None,
+                 recorder=None, snapshot_writer=None, restore_state=None, lcd=None,
+                 control_socket=None, control_port=None, fog=None, displays=(),
+                 status=None, resource_monitor=None):
+        self.engine = engine
+        self.idle = idle
+        self.snapshot_writer = snapshot_writer
+        self.resource_monitor = resource_monitor
+        self.restore_state = restore_state
+        # Blocking hardware I/O happens on one extra thread
+        self.io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='io')
+        self.listener = AsyncMusicListener(self, engine=engine, keymap=keymap,
+                                           recorder=recorder, fog=fog)
+        self.menu = LCDMenu(lcd=lcd, recorder=recorder, idle=idle, displays=displays,
+                            status=status)
+        self.menu.add_entries(*menu_entries(EngineProxy(engine, self)))
+        self.control_socket = control_socket
+        self.control_port = control_port
+        self.control_server = ControlServer(self.listener, self.run_steps)
+        # Operations the engine starts by itself (e.g. releasing the
+        # player when idle) also wait their turn
+        engine.schedule = lambda steps: self.spawn(self.run_steps(steps))
+        self._audio_lock = None
+        # Keep references to running tasks so they aren't collected
+        self._tasks = set()
+
+    def spawn(self, coro):
+        """Start a background task on the loop."""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def run_steps(self, steps):
+        """Carry out an audio engine operation, one step at a time.
+
+        Operations are run one after the other, in the order they
+        were requested.
+
+        """
+        async with self._audio_lock:
+            for delay in steps:
+                self.engine.record_position()
+                await asyncio.sleep(delay)
+            self.engine.record_position()
+
+    def run_io(self, func, *args):
+        """Run a blocking function on the I/O executor."""
+        return self.loop.run_in_executor(self.io_executor, func, *args)
+
+    async def read_keys(self):
+        """Act on numberpad keys as they arrive from the listener."""
+        while True:
+            key = await self.keys.get()
+            steps = self.listener.key_steps(key)
+            if steps is not None:
+                # Don't hold up the next key while this one fades
+                self.spawn(self.run_steps(steps))
+
+    async def scan_buttons(self):
+        """Poll the LCD plate's buttons and refresh the display."""
+        menu = self.menu
+        await self.run_io(menu.refresh_text)
+        while True:
+            held = await self.run_io(menu.poll)
+            await asyncio.sleep(menu.active_scan_interval if held else menu.scan_interval)
+
+    async def save_snapshots(self):
+        """Periodically save the playback state."""
+        writer = self.snapshot_writer
+        while True:
+            await asyncio.sleep(writer.interval)
+            await self.run_io(writer.save)
+
+    async def check_resources(self):
+        """Periodically check memory and CPU use."""
+        monitor = self.resource_monitor
+        while True:
+            # Reading /proc for every thread can take a while
+            await self.run_io(monitor.sample)
+            await asyncio.sleep(monitor.interval)
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        self.keys = asyncio.Queue()
+        self._audio_lock = asyncio.Lock()
+        # Shut down cleanly on Ctrl-C or SIGTERM
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(signum, stop.set)
+        if self.idle is not None:
+            self.idle.use_loop(self.loop)
+            self.idle.touch()
+        # Start all the pieces
+        tasks = [asyncio.create_task(self.read_keys()),
+                 asyncio.create_task(self.scan_buttons())]
+        if self.snapshot_writer is not None:
+            tasks.append(asyncio.create_task(self.save_snapshots()))
+        if self.resource_monitor is not None:
+            tasks.append(asyncio.create_task(self.check_resources()))
+        if self.restore_state is not None:
+            self.spawn(self.run_steps(self.engine.restore_steps(self.restore_state)))
+        if self.control_socket is not None or self.control_port is not None:
+            await self.control_server.start(socket_file=self.control_socket,
+                                            port=self.control_port)
+        self.listener.start()
+        log.info("D&D Music started. Waiting for keypress...")
+        try:
+            await stop.wait()
+        finally:
+            log.info("Shutting down")
+            await self.control_server.close()
+            self.listener.stop()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self.idle is not None:
+                self.idle.cancel()
+            # Remember what was playing, then fade it out
+            if self.snapshot_writer is not None:
+                await self.run_io(partial(self.snapshot_writer.save, force=True))
+            await self.run_steps(self.engine.stop_music_steps(fade_time=0.5))
+            self.io_executor.shutdown(wait=True)
+
+    def run(self):
+        """Run until interrupted by SIGINT or SIGTERM."""
+        asyncio.run(self.main())
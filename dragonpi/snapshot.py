@@ -0,0 +1,132 @@
+# This file is part of DragonPi.
+#
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Save the playback state so it can be restored after a crash.
+
+The snapshot is a small JSON file, replaced atomically so that a
+power cut leaves either the old or the new version. To spare the SD
+card, it is only rewritten when something changed: right away for a
+new song, volume or pause, but at most every ``position_interval``
+seconds when only the position in the song moved on.
+
+"""
+
+import logging
+log = logging.getLogger(__name__)
+import json
+import os
+import threading
+import time
+
+STATE_DIR = os.environ.get('XDG_STATE_HOME',
+                           os.path.join(os.path.expanduser('~'), '.local', 'state'))
+SNAPSHOT_FILE = os.path.join(STATE_DIR, 'dragonpi', 'snapshot.json')
+
+
+def write_snapshot(filename, state):
+    """Atomically replace *filename* with the JSON-encoded *state*."""
+    dirname = os.path.dirname(filename)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    tmp_file = f'{filename}.tmp'
+    with open(tmp_file, mode='w') as fp:
+        json.dump(state, fp)
+        fp.flush()
+        # Make sure the data is on disk before it replaces the old snapshot
+        os.fsync(fp.fileno())
+    os.replace(tmp_file, filename)
+    # The rename itself is only durable once the directory is synced
+    dir_fd = os.open(dirname or '.', os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def read_snapshot(filename):
+    """Load a snapshot, or return None if there isn't a usable one."""
+    try:
+        with open(filename, mode='r') as fp:
+            state = json.load(fp)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        log.warning("Could not read snapshot %s: %s", filename, e)
+        return None
+    if not isinstance(state, dict):
+        log.warning("Could not read snapshot %s: not a JSON object", filename)
+        return None
+    return state
+
+
+class SnapshotWriter(threading.Thread):
+    """Periodically save an audio engine's state in the background.
+
+    Parameters
+    ----------
+    engine : audio.AudioEngine
+      The engine whose state gets saved.
+    filename : str
+      Where to keep the snapshot.
+    interval : float
+      How often, in seconds, to check for changes.
+    position_interval : float
+      Minimum time, in seconds, between snapshots when only the
+      position in the song has changed.
+
+    """
+    def __init__(self, engine, filename=SNAPSHOT_FILE, interval=2.,
+                 position_interval=60.):
+        super().__init__(name='SnapshotWriter', daemon=True)
+        self.engine = engine
+        self.filename = filename
+        self.interval = interval
+        self.position_interval = position_interval
+        self._last_state = None
+        self._last_write = 0
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def save(self, force=False):
+        """Write a snapshot if the engine's state has changed enough.
+
+        Returns
+        -------
+        bool
+          Whether a new snapshot was written.
+
+        """
+        state = self.engine.snapshot()
+        last_state = self._last_state or {}
+        # Compare everything except for the position
+        changed = any(state[k] != last_state.get(k) for k in state if k != 'position')
+        moved = (state['position'] != last_state.get('position')
+                 and time.monotonic() - self._last_write >= self.position_interval)
+        if not (force or changed or moved):
+            return False
+        try:
+            write_snapshot(self.filename, state)
+        except OSError as e:
+            log.error("Could not write snapshot %s: %s", self.filename, e)
+            return False
+        self._last_state = state
+        self._last_write = time.monotonic()
+        return True
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.save()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# This file is part of DragonPi.
+#
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Fire thousands of cues at the audio engine to look for leaks.
+
+The cues run against the fake VLC backend without any waiting, so
+hours of a game go by in seconds. Every so often, the engine's count
+of live players and media is compared with the fake backend's own
+count, and both should stay flat however many cues have gone by.
+
+"""
+
+import logging
+log = logging.getLogger(__name__)
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+from .audio import AudioEngine
+from .fakevlc import FakeInstance
+from .resources import read_rss
+
+# Relative weights of each kind of cue
+CUES = {
+    'play': 6,
+    'volume': 2,
+    'pause': 1,
+    'release': 1,
+    'stop': 1,
+}
+
+
+def run_now(steps):
+    """Carry out engine steps without waiting in between."""
+    for delay in steps:
+        pass
+
+
+def soak(engine, song_files, cues, report_every=500, seed=0):
+    """Fire *cues* random cues at *engine*.
+
+    Returns
+    -------
+    samples : list
+      Dicts with the ``cue`` number, the engine's ledger ``counts``,
+      the backend's ``live`` objects and the ``rss``, taken every
+      *report_every* cues.
+
+    """
+    rng = random.Random(seed)
+    kinds = list(CUES)
+    weights = [CUES[kind] for kind in kinds]
+    samples = []
+    for cue in range(1, cues + 1):
+        kind = rng.choices(kinds, weights)[0]
+        if kind == 'play':
+            run_now(engine.play_song_steps(rng.choice(song_files), 100, 0.1))
+        elif kind == 'volume':
+            run_now(engine.change_volume_steps(rng.choice((-10, 10))))
+        elif kind == 'pause':
+            run_now(engine.toggle_pause_steps())
+        elif kind == 'release':
+            # As if the program went idle
+            engine.release_player()
+        elif kind == 'stop':
+            run_now(engine.stop_music_steps(fade_time=0.1))
+        if cue % report_every == 0 or cue == cues:
+            samples.append({
+                'cue': cue,
+                'counts': engine.resources.counts(),
+                'live': dict(engine.instance.live),
+                'rss': read_rss(),
+            })
+    return samples
+
+
+def find_leaks(samples, engine):
+    """Check the samples from ``soak()`` for signs of leaks.
+
+    Returns
+    -------
+    problems : list
+      Descriptions of anything that looks wrong.
+
+    """
+    problems = []
+    limits = engine.resources.limits
+    for sample in samples:
+        for kind, count in sample['live'].items():
+            if count != sample['counts'].get(kind, 0):
+                problems.append(f"Cue {sample['cue']}: {count} live {kind} objects, "
+                                f"but the engine counted {sample['counts'].get(kind, 0)}")
+            if count > limits.get(kind, count):
+                problems.append(f"Cue {sample['cue']}: {count} live {kind} objects, "
+                                f"more than the limit of {limits[kind]}")
+    return problems
+
+
+def parse_args():
+    """Parse the command-line arguments and return the options."""
+    parser = argparse.ArgumentParser(description="Soak-test the DragonPi audio engine.")
+    parser.add_argument('-n', '--cues', type=int, default=10000, help="How many cues to fire")
+    parser.add_argument('-s', '--songs', type=int, default=20,
+                        help="How many different songs to cue")
+    parser.add_argument('-r', '--report-every', type=int, default=1000,
+                        help="Cues between measurements")
+    parser.add_argument('-d', '--debug', action='store_true', help="Spit out verbose logging")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+    with tempfile.TemporaryDirectory() as song_dir:
+        # The fake backend doesn't read the songs, but they must exist
+        song_files = []
+        for idx in range(args.songs):
+            song_file = os.path.join(song_dir, f'song_{idx}.mp3')
+            open(song_file, mode='w').close()
+            song_files.append(song_file)
+        engine = AudioEngine(instance=FakeInstance())
+        samples = soak(engine, song_files, args.cues, report_every=args.report_every)
+    # Report the results
+    for sample in samples:
+        counts = ', '.join(f'{kind}={count}' for kind, count in sorted(sample['live'].items()))
+        rss = f"{sample['rss'] / 2**20:.1f} MB" if sample['rss'] is not None else "unknown"
+        print(f"{sample['cue']:>8} cues: {counts}, RSS {rss}")
+    problems = find_leaks(samples, engine)
+    for problem in problems:
+        print(problem)
+    if samples[0]['rss'] is not None:
+        growth = (samples[-1]['rss'] - samples[0]['rss']) / 2**20
+        print(f"RSS grew by {growth:.1f} MB after the first {samples[0]['cue']} cues")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
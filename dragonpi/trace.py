@@ -0,0 +1,160 @@
+# This file is part of DragonPi.
+#
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Low-overhead event tracing for all of DragonPi's threads.
+
+Events are stored in a preallocated ring buffer, so only the most
+recent events are kept, and can be written out in the Chrome
+trace-event format to be viewed with ``chrome://tracing`` or
+https://ui.perfetto.dev. Tracing is off until ``tracer.enabled`` is
+set, and costs a single attribute check while off.
+
+Typical usage::
+
+    from .trace import tracer
+
+    with tracer.span('fade', target=50):
+        ...
+    tracer.instant('key', key='1')
+
+"""
+
+import logging
+log = logging.getLogger(__name__)
+import itertools
+import json
+import os
+import signal
+import threading
+import time
+
+# Chrome trace-event phases
+INSTANT = 'i'
+COMPLETE = 'X'
+
+
+class Span():
+    """Context manager that records how long its block took."""
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        if self.tracer.enabled:
+            self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            self.tracer.complete(self.name, self.start, self.args)
+
+
+class Tracer():
+    """A fixed-size ring buffer of ``(timestamp, thread, event, args)``
+    records.
+
+    Parameters
+    ----------
+    capacity : int
+      How many events to keep before the oldest are overwritten.
+
+    """
+    enabled = False
+
+    def __init__(self, capacity=65536):
+        self.capacity = capacity
+        self.clear()
+
+    def clear(self):
+        """Discard all recorded events."""
+        self._buffer = [None] * self.capacity
+        # next() on an itertools.count is atomic, so no lock is needed
+        self._counter = itertools.count()
+
+    def _add(self, timestamp, phase, name, duration, args):
+        idx = next(self._counter) % self.capacity
+        self._buffer[idx] = (timestamp, threading.get_ident(), name, phase,
+                             duration, args)
+
+    def instant(self, name, args=None):
+        """Record a single point in time."""
+        if self.enabled:
+            self._add(time.perf_counter_ns(), INSTANT, name, 0, args)
+
+    def complete(self, name, start, args=None):
+        """Record an event that started at *start* (from
+        ``time.perf_counter_ns()``) and ends now."""
+        if self.enabled:
+            self._add(start, COMPLETE, name, time.perf_counter_ns() - start, args)
+
+    def span(self, name, **args):
+        """Context manager that records the duration of its block."""
+        return Span(self, name, args)
+
+    def events(self):
+        """List of recorded events, oldest first."""
+        return sorted((e for e in list(self._buffer) if e is not None),
+                      key=lambda e: e[0])
+
+    def chrome_trace(self):
+        """Convert the recorded events to a Chrome trace-event dict."""
+        pid = os.getpid()
+        trace_events = []
+        thread_ids = set()
+        for timestamp, tid, name, phase, duration, args in self.events():
+            event = {'name': name, 'ph': phase, 'ts': timestamp / 1000,
+                     'pid': pid, 'tid': tid}
+            if phase == COMPLETE:
+                event['dur'] = duration / 1000
+            else:
+                event['s'] = 't'
+            if args:
+                event['args'] = {k: str(v) for k, v in args.items()}
+            trace_events.append(event)
+            thread_ids.add(tid)
+        # Label the threads that are still around
+        for thread in threading.enumerate():
+            if thread.ident in thread_ids:
+                trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                                     'tid': thread.ident,
+                                     'args': {'name': thread.name}})
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def dump(self, filename):
+        """Write the recorded events to *filename* as Chrome trace JSON."""
+        with open(filename, mode='w') as fp:
+            json.dump(self.chrome_trace(), fp)
+        log.info("Wrote trace to %s", filename)
+
+    def install_signal_handler(self, filename, signum=signal.SIGUSR1):
+        """Dump the trace to *filename* whenever *signum* is received.
+
+        Must be called from the main thread.
+
+        """
+        def handler(signum, frame):
+            try:
+                self.dump(filename)
+            except OSError as e:
+                log.error("Could not write trace to %s: %s", filename, e)
+        signal.signal(signum, handler)
+
+
+# The tracer shared by the whole program
+tracer = Tracer()
@@ -6,10 +6,15 @@ setup(
     version='0.1',
     author='Mark Wolfman',
     author_email='canismarko@gmail.com',
-    packages=['dragonpi'],
+    packages=['dragonpi', 'dragonpi.maps'],
+    package_data={'dragonpi.maps': ['viewer.html']},
     entry_points={
         'console_scripts': [
             'dragonpi = dragonpi.run_game:main',
+            'dragonpi-replay = dragonpi.replay:main',
+            'dragonpi-ctl = dragonpi.control:main',
+            'dragonpi-maps = dragonpi.maps.server:main',
+            'dragonpi-soak = dragonpi.soak:main',
         ],
     },
     url='https://github.com/canismarko/dragonpi',
@@ -20,4 +25,7 @@ setup(
         "pynput",
         "python-vlc",
     ],
+    extras_require={
+        'maps': ["Pillow"],
+    },
 )
@@ -0,0 +1,144 @@
+# This file is part of DragonPi.
+# 
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import tempfile
+import threading
+import time
+from unittest import mock, TestCase
+
+from dragonpi.audio import AudioEngine, find_output_devices
+from dragonpi.fakevlc import FakeInstance
+from dragonpi.idle import IdleManager
+
+
+class TestAudioEngine(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.song_file = os.path.join(self.tmpdir.name, 'tavern.mp3')
+        open(self.song_file, mode='w').close()
+    
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    
+    def test_play_and_stop(self):
+        engine = AudioEngine(instance=FakeInstance())
+        engine.play_song(self.song_file, 100, fade_time=0.01)
+        player = engine._player
+        self.assertTrue(player.is_playing)
+        self.assertEqual(player.volume, 100)
+        self.assertEqual(engine.song_file, self.song_file)
+        engine.stop_music(fade_time=0.01)
+        self.assertFalse(player.is_playing)
+        self.assertIs(engine._player, None)
+    
+    def test_release_when_idle(self):
+        idle = IdleManager(timeout=None)
+        engine = AudioEngine(instance=FakeInstance(), idle=idle)
+        engine.play_song(self.song_file, 100, fade_time=0.01)
+        # Going idle while playing should do nothing
+        engine.release_player()
+        self.assertIsNot(engine._player, None)
+        # Pause, then release the player
+        engine.toggle_pause()
+        player = engine._player
+        player.set_time(42000)
+        engine.release_player()
+        self.assertIs(engine._player, None)
+        self.assertFalse(player.is_playing)
+        # Resuming should pick up at the same place with the same media
+        media = player.get_media()
+        engine.toggle_pause()
+        self.assertIsNot(engine._player, player)
+        self.assertIs(engine._player.get_media(), media)
+        self.assertGreaterEqual(engine._player.get_time(), 42000)
+        self.assertFalse(engine.paused)
+    
+    def test_snapshot_while_busy(self):
+        engine = AudioEngine(instance=FakeInstance())
+        engine.play_song(self.song_file, 100, fade_time=0.01)
+        player = engine._player
+        player.set_time(42000)
+        self.assertEqual(engine.snapshot()['position'], 42000)
+        # Stop slowly in another thread, which releases the player
+        callers = []
+        get_time = player.get_time
+        def record_caller():
+            callers.append(threading.current_thread())
+            return get_time()
+        player.get_time = record_caller
+        stopper = threading.Thread(target=engine.stop_music, kwargs={'fade_time': 0.5})
+        stopper.start()
+        time.sleep(0.05)
+        # The last recorded position is used, without asking the player
+        start = time.monotonic()
+        self.assertGreaterEqual(engine.snapshot()['position'], 42000)
+        self.assertLess(time.monotonic() - start, 0.2)
+        stopper.join()
+        self.assertNotIn(threading.current_thread(), callers)
+        self.assertIs(engine._player, None)
+    
+    def test_switch_output(self):
+        engine = AudioEngine(instance=FakeInstance())
+        engine.play_song(self.song_file, 100, fade_time=0.01)
+        player = engine._player
+        engine.set_output(2, fade_time=0.01)
+        # The same player should have moved to the new device
+        self.assertIs(engine._player, player)
+        self.assertEqual(player.device, engine.output_devices[2])
+        self.assertEqual(player.volume, 100)
+        self.assertTrue(player.is_playing)
+        self.assertEqual(engine.output_idx, 2)
+        # New songs should use the new output too
+        engine.play_song(self.song_file, 100, fade_time=0.01)
+        self.assertEqual(engine._player.device, engine.output_devices[2])
+
+    
+    def test_find_output_devices(self):
+        listing = ("default\n    Default ALSA Output\n"
+                   "hdmi:CARD=vc4hdmi0,DEV=0\n    vc4-hdmi-0, MAI PCM i2s-hifi-0\n"
+                   "sysdefault:CARD=vc4hdmi0\n    vc4-hdmi-0, MAI PCM i2s-hifi-0\n"
+                   "sysdefault:CARD=vc4hdmi1\n    vc4-hdmi-1, MAI PCM i2s-hifi-0\n"
+                   "sysdefault:CARD=Headphones\n    bcm2835 Headphones\n")
+        self.assertEqual(find_output_devices(listing),
+                         ('default', 'sysdefault:CARD=Headphones',
+                          'sysdefault:CARD=vc4hdmi0'))
+        # Missing outputs keep the defaults
+        self.assertEqual(find_output_devices(''), AudioEngine.output_devices)
+        engine = AudioEngine(instance=FakeInstance(), output_devices=['a', 'b', 'c'])
+        self.assertEqual(engine.output_devices, ('a', 'b', 'c'))
+
+
+class TestIdleManager(TestCase):
+    def test_go_idle(self):
+        idle = IdleManager(timeout=0.01)
+        on_idle = mock.MagicMock()
+        on_active = mock.MagicMock()
+        idle.subscribe(on_idle=on_idle, on_active=on_active)
+        # Being busy prevents going idle
+        idle.set_busy(True)
+        time.sleep(0.05)
+        on_idle.assert_not_called()
+        # Go idle after the timeout
+        idle.set_busy(False)
+        time.sleep(0.05)
+        on_idle.assert_called_once()
+        self.assertTrue(idle.is_idle)
+        # Wake up again
+        idle.touch()
+        on_active.assert_called_once()
+        self.assertFalse(idle.is_idle)
+        idle.cancel()
@@ -0,0 +1,138 @@
+# This file is part of DragonPi.
+# 
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import asyncio
+import json
+import os
+import tempfile
+from unittest import mock, TestCase
+
+from pynput import keyboard
+
+from dragonpi.audio import AudioEngine
+from dragonpi.control import ControlServer, MAX_LINE, send_commands, load_test
+from dragonpi.dndmusic import MusicListener
+from dragonpi.fakevlc import FakeInstance
+
+
+class TestControlServer(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.socket_file = os.path.join(self.tmpdir.name, 'control.sock')
+        self.engine = AudioEngine(instance=FakeInstance())
+        self.listener = MusicListener(engine=self.engine)
+        self.ran = []
+        async def run_steps(steps):
+            self.ran.append(steps)
+            for delay in steps:
+                pass
+        self.server = ControlServer(self.listener, run_steps)
+    
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    
+    def test_handle_batch(self):
+        async def scenario():
+            with mock.patch.object(self.engine, 'change_volume_steps') as change_volume:
+                change_volume.return_value = iter([])
+                replies = await self.server.handle_batch(
+                    [b'VOL -10', b'vol -5', b'PING', b'VOL 3', b'BOGUS', b'', b'CUE ../x.mp3'])
+            # Consecutive volume changes are merged
+            self.assertEqual(change_volume.call_args_list, [mock.call(-15.), mock.call(3.)])
+            self.assertEqual(replies[:4], [b'OK\n'] * 4)
+            self.assertTrue(replies[4].startswith(b'ERR Unknown command'))
+            self.assertTrue(replies[5].startswith(b'ERR Invalid song'))
+            await asyncio.sleep(0)
+        asyncio.run(scenario())
+    
+    def test_key_dispatch(self):
+        key = keyboard.KeyCode.from_char('1')
+        self.listener.set_key_assignments({key: ('VolUp', None, None)})
+        async def scenario():
+            replies = await self.server.handle_batch([b'KEY 1', b'KEY 2'])
+            await asyncio.sleep(0)
+            return replies
+        replies = asyncio.run(scenario())
+        self.assertEqual(replies[0], b'OK\n')
+        self.assertTrue(replies[1].startswith(b'ERR Key not assigned'))
+        self.assertEqual(self.engine.volume, 100)  # Already at max
+        self.assertEqual(len(self.ran), 1)
+    
+    def test_bad_commands(self):
+        async def scenario():
+            return await self.server.handle_batch(
+                [b'VOL nan', b'VOL inf', b'CUE ..', b'CUE .', b'PING'])
+        replies = asyncio.run(scenario())
+        self.assertTrue(all(r.startswith(b'ERR') for r in replies[:4]))
+        self.assertEqual(replies[4], b'OK\n')
+        self.assertEqual(self.engine.volume, 100)
+        self.assertEqual(self.ran, [])
+        with self.assertRaises(ValueError):
+            self.engine.change_volume(float('nan'))
+        self.assertEqual(self.engine.volume, 100)
+    
+    def test_failed_steps(self):
+        def steps():
+            raise RuntimeError("Broken")
+            yield 0
+        async def scenario():
+            with mock.patch.object(self.server, 'steps_for', return_value=steps()):
+                return await self.server.handle_batch([b'STOP'])
+        with self.assertLogs('dragonpi.control', level='ERROR'):
+            replies = asyncio.run(scenario())
+        self.assertEqual(replies, [b'ERR Broken\n'])
+    
+    def test_stale_socket(self):
+        # Don't delete things that aren't sockets
+        open(self.socket_file, mode='w').close()
+        with self.assertRaises(FileExistsError):
+            asyncio.run(self.server.start(socket_file=self.socket_file))
+        self.assertTrue(os.path.exists(self.socket_file))
+    
+    def test_unix_socket(self):
+        async def scenario():
+            await self.server.start(socket_file=self.socket_file)
+            try:
+                replies = await send_commands(['VOL -10'], socket_file=self.socket_file)
+                replies += await send_commands(['STATUS'], socket_file=self.socket_file)
+                elapsed, round_trips = await load_test('PING', 20, pipeline=5,
+                                                       socket_file=self.socket_file)
+            finally:
+                await self.server.close()
+            return replies, round_trips
+        replies, round_trips = asyncio.run(scenario())
+        self.assertEqual(replies[0], 'OK')
+        self.assertTrue(replies[1].startswith('OK '))
+        status = json.loads(replies[1][3:])
+        self.assertEqual(status['volume'], 90)
+        self.assertEqual(len(round_trips), 4)
+    
+    def test_long_line(self):
+        async def scenario():
+            await self.server.start(socket_file=self.socket_file)
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.socket_file)
+                # A command, then a line that never ends
+                writer.write(b'PING\n' + b'A' * (MAX_LINE + 1))
+                await writer.drain()
+                replies = await asyncio.wait_for(reader.read(), timeout=1)
+                writer.close()
+            finally:
+                await self.server.close()
+            return replies
+        replies = asyncio.run(scenario())
+        # The client is cut off once the line is too long
+        self.assertEqual(replies, b'OK\nERR line too long\n')
@@ -0,0 +1,102 @@
+# This file is part of DragonPi.
+# 
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from unittest import mock, TestCase
+
+from dragonpi.display import DisplayWriter, Frame
+from dragonpi.lcdmenu import LCDMenu, MenuItem
+
+WHITE = (1., 1., 1.)
+
+
+class TestDisplayWriter(TestCase):
+    def test_diff(self):
+        lcd = mock.MagicMock()
+        writer = DisplayWriter(lcd)
+        # The first frame is drawn in full
+        writer.show(Frame('Volume', '50%', (), WHITE))
+        lcd.clear.assert_called_once()
+        lcd.set_color.assert_called_once_with(*WHITE)
+        lcd.message.assert_called_once_with('Volume\n50%')
+        lcd.reset_mock()
+        # Only the changed characters are written afterwards
+        written = writer.show(Frame('Volume', '60%', (), WHITE))
+        self.assertEqual(written, 1)
+        lcd.clear.assert_not_called()
+        lcd.set_color.assert_not_called()
+        lcd.set_cursor.assert_called_once_with(0, 1)
+        lcd.message.assert_called_once_with('6')
+        lcd.reset_mock()
+        # Nearby changes are merged, and nothing is written if nothing changed
+        self.assertEqual(writer.show(Frame('Volume', '0% x', (), WHITE)), 4)
+        lcd.message.assert_called_once_with('0% x')
+        lcd.reset_mock()
+        self.assertEqual(writer.show(Frame('Volume', '0% x', (), WHITE)), 0)
+        lcd.message.assert_not_called()
+    
+    def test_layout(self):
+        frame = Frame('A very long menu item name', 'Option', ('Tavern', 'Volume 80%'), WHITE)
+        small = DisplayWriter(mock.MagicMock())
+        self.assertEqual(small.layout(frame), ['A very long menu', 'Option          '])
+        big = DisplayWriter(mock.MagicMock(), cols=20, lines=4)
+        self.assertEqual([row.rstrip() for row in big.layout(frame)],
+                         ['A very long menu ite', 'Option', 'Tavern', 'Volume 80%'])
+        self.assertEqual(DisplayWriter(mock.MagicMock(), lines=4).layout(
+            Frame('A', 'B', (), WHITE))[2:], [' ' * 16] * 2)
+
+
+class TestMirroredMenu(TestCase):
+    def test_fan_out(self):
+        lcd = mock.MagicMock()
+        lcd.is_pressed.return_value = False
+        mirror = DisplayWriter(mock.MagicMock(), cols=20, lines=4)
+        status = ['Stopped', 'Volume 100%']
+        menu = LCDMenu(lcd=lcd, displays=[mirror], status=lambda: status)
+        item = MenuItem()
+        item.name = 'Greeting'
+        menu.add_entries(item)
+        menu.refresh_text()
+        lcd.message.assert_called_once_with('Greeting\n[Greeting text]')
+        mirror.lcd.message.assert_called_once_with(
+            'Greeting\n[Greeting text]\nStopped\nVolume 100%')
+        # Both displays got the checkmark character
+        mirror.lcd.create_char.assert_called_once()
+        # A new status only touches the display that shows it
+        lcd.reset_mock()
+        mirror.lcd.reset_mock()
+        status[0] = 'tavern.mp3'
+        menu._last_refresh = 0
+        menu.poll()
+        lcd.message.assert_not_called()
+        mirror.lcd.set_cursor.assert_called_once_with(0, 2)
+        mirror.lcd.message.assert_called_once_with('tavern.mp3')
+    
+    @mock.patch('dragonpi.lcdmenu.time.sleep')
+    def test_error_flash(self, sleep):
+        lcd = mock.MagicMock()
+        mirror = DisplayWriter(mock.MagicMock(), cols=20, lines=4)
+        menu = LCDMenu(lcd=lcd, displays=[mirror])
+        menu.add_entries(MenuItem())
+        menu.refresh_text()
+        lcd.reset_mock()
+        mirror.lcd.reset_mock()
+        # Plain menu items can't be changed with the right button
+        menu.right_pressed()
+        red = (1., 0., 0.)
+        for display in menu.displays:
+            self.assertEqual(display.lcd.set_color.call_args_list,
+                             [mock.call(*red), mock.call(*WHITE)])
+            self.assertEqual(display.color, WHITE)
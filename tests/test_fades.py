@@ -0,0 +1,75 @@
+# This file is part of DragonPi.
+# 
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from unittest import TestCase
+
+from dragonpi.fades import fade_plan, num_steps, CURVES
+
+
+class TestFades(TestCase):
+    def test_curves(self):
+        for name, table in CURVES.items():
+            self.assertAlmostEqual(table[0], 0, msg=name)
+            self.assertAlmostEqual(table[-1], 1, msg=name)
+            self.assertEqual(list(table), sorted(table), msg=name)
+    
+    def test_num_steps(self):
+        # Short fades use only a few steps
+        self.assertEqual(num_steps(0.05, interval=0.05), 1)
+        self.assertEqual(num_steps(0.01, interval=0.05), 1)
+        self.assertEqual(num_steps(0.3, interval=0.05), 6)
+        # Long fades keep updating at the same rate
+        self.assertEqual(num_steps(10, 255, interval=0.05), 200)
+        # ...unless the volume doesn't change enough to need it
+        self.assertEqual(num_steps(10, 5, interval=0.05), 5)
+        self.assertEqual(num_steps(10, -5, interval=0.05), 5)
+    
+    def test_fade_plan(self):
+        for curve in CURVES.keys():
+            for start, end in [(0, 100), (100, 0), (80, 40)]:
+                plan = fade_plan(start, end, 1.5, curve=curve)
+                volumes = [v for v, hold in plan]
+                self.assertEqual(volumes[-1], end)
+                self.assertAlmostEqual(sum(hold for v, hold in plan), 1.5)
+                # Volume should move steadily in one direction
+                self.assertEqual(volumes, sorted(volumes, reverse=(end < start)))
+                self.assertLessEqual(len(plan), abs(end - start))
+    
+    def test_long_fade(self):
+        plan = fade_plan(0, 100, 10., curve='linear')
+        # A slow fade moves one volume point at a time
+        volumes = [v for v, hold in plan]
+        self.assertEqual(volumes, list(range(1, 101)))
+        self.assertAlmostEqual(sum(hold for v, hold in plan), 10.)
+    
+    def test_merge_repeated_volumes(self):
+        plan = fade_plan(50, 52, 1.5, curve='linear')
+        self.assertEqual([v for v, hold in plan], [51, 52])
+        self.assertAlmostEqual(sum(hold for v, hold in plan), 1.5)
+        # The equal-power curve flattens out near the end
+        plan = fade_plan(0, 100, 10.)
+        volumes = [v for v, hold in plan]
+        self.assertEqual(len(set(volumes)), len(volumes))
+        self.assertLess(len(plan), 100)
+        self.assertAlmostEqual(sum(hold for v, hold in plan), 10.)
+    
+    def test_equal_power(self):
+        # Fading in should rise faster than linear
+        plan = dict(enumerate(fade_plan(0, 100, 1., interval=0.5)))
+        self.assertEqual(plan[0][0], 71)
+        # Fading out should drop slower than linear
+        plan = dict(enumerate(fade_plan(100, 0, 1., interval=0.5)))
+        self.assertEqual(plan[0][0], 71)
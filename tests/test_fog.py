@@ -0,0 +1,172 @@
+# This file is part of DragonPi.
+# 
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import asyncio
+import base64
+import queue
+import time
+from unittest import mock, TestCase
+
+from pynput import keyboard
+
+from dragonpi.audio import AudioEngine
+from dragonpi.control import ControlServer
+from dragonpi.dndmusic import MusicListener
+from dragonpi.fakevlc import FakeInstance
+from dragonpi.maps.fog import FogMask, FogBoard
+from dragonpi.maps.tiles import MapError
+
+
+def drain(events):
+    received = []
+    while True:
+        try:
+            received.append(events.get_nowait())
+        except queue.Empty:
+            return received
+
+
+class TestFogMask(TestCase):
+    def test_update(self):
+        mask = FogMask(10, 5)
+        self.assertEqual(len(mask.bits), 7)
+        self.assertEqual(mask.update([(1, 1), (3, 2), (12, 0)]), (1, 1, 3, 2))
+        self.assertTrue(mask[3, 2])
+        self.assertFalse(mask[2, 2])
+        # Nothing changes the second time
+        self.assertIsNone(mask.update([(1, 1), (3, 2)]))
+        self.assertEqual(mask.update([(3, 2)], revealed=False), (3, 2, 1, 1))
+        self.assertEqual(mask.count(), 1)
+    
+    def test_circle_and_region(self):
+        mask = FogMask(10, 10)
+        self.assertEqual(mask.update_circle(0, 0, 1), (0, 0, 2, 2))
+        self.assertEqual(mask.count(), 3)
+        region = FogMask(2, 2, mask.region(0, 0, 2, 2))
+        self.assertEqual([region[0, 0], region[1, 0], region[0, 1], region[1, 1]],
+                         [True, True, True, False])
+    
+    def test_huge_circle(self):
+        mask = FogMask(40, 30)
+        start = time.monotonic()
+        self.assertEqual(mask.update_circle(0, 0, 1000000), (0, 0, 40, 30))
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(mask.count(), 40 * 30)
+        # Circles centered off the map still only cover cells on it
+        self.assertIsNone(mask.update_circle(-50, -50, 5, revealed=False))
+    
+    def test_fill(self):
+        mask = FogMask(3, 3)
+        self.assertEqual(mask.fill(), (0, 0, 3, 3))
+        self.assertEqual(mask.count(), 9)
+        self.assertIsNone(mask.fill())
+        mask.fill(revealed=False)
+        self.assertEqual(mask.count(), 0)
+
+
+class TestFogBoard(TestCase):
+    def setUp(self):
+        library = mock.MagicMock()
+        library.info.return_value = {'width': 320, 'height': 200}
+        self.board = FogBoard(library, cell_size=32)
+    
+    def test_deltas(self):
+        board = self.board
+        events = board.subscribe()
+        self.assertEqual(drain(events), [])
+        board.show('cave.png')
+        names = [name for name, data in drain(events)]
+        self.assertEqual(names, ['map', 'fog', 'cursor'])
+        self.assertEqual(board.cursor, (5, 3))
+        # Reveal around the cursor, only the changed cells are sent
+        board.reveal()
+        (name, data), = drain(events)
+        self.assertEqual(name, 'fog')
+        self.assertEqual((data['x'], data['y'], data['w'], data['h']), (3, 1, 5, 5))
+        region = FogMask(5, 5, base64.b64decode(data['bits']))
+        self.assertEqual(region.count(), 13)
+        # Revealing it again changes nothing
+        board.reveal()
+        self.assertEqual(drain(events), [])
+        # New subscribers get the whole current state
+        late = board.subscribe()
+        map_event, fog_event, cursor_event = drain(late)
+        self.assertEqual(map_event[1], {'map': 'cave.png', 'cell_size': 32, 'w': 10, 'h': 7})
+        self.assertEqual((fog_event[1]['w'], fog_event[1]['h']), (10, 7))
+        board.unsubscribe(late)
+        board.move_cursor(-10, 0)
+        self.assertEqual(board.cursor, (0, 3))
+        self.assertEqual(drain(late), [])
+    
+    def test_numberpad_and_control(self):
+        board = self.board
+        board.show('cave.png')
+        listener = MusicListener(engine=AudioEngine(instance=FakeInstance()), fog=board)
+        listener.set_key_assignments({
+            keyboard.KeyCode.from_char('4'): ('FogLeft', None, None),
+            keyboard.KeyCode.from_char('5'): ('FogReveal', None, None),
+        })
+        # Fog keys don't wait for the audio engine
+        engine = listener.engine
+        with mock.patch.object(engine, 'run') as run:
+            listener.handle_key(keyboard.KeyCode.from_char('4'))
+            listener.handle_key(keyboard.KeyCode.from_char('5'))
+        run.assert_not_called()
+        self.assertEqual(board.cursor, (4, 3))
+        self.assertTrue(board.mask('cave.png')[4, 3])
+        # Now from the control socket
+        async def run_steps(steps):
+            for delay in steps:
+                pass
+        server = ControlServer(listener, run_steps)
+        async def scenario():
+            return await server.handle_batch([b'FOG REVEAL 9 6 0', b'FOG HIDE 4 3',
+                                              b'FOG SPIN'])
+        replies = asyncio.run(scenario())
+        self.assertEqual(replies[:2], [b'OK\n', b'OK\n'])
+        self.assertTrue(replies[2].startswith(b'ERR'))
+        self.assertTrue(board.mask('cave.png')[9, 6])
+        self.assertFalse(board.mask('cave.png')[4, 3])
+        # Radii are checked against the size of the map
+        async def bad_radii():
+            return await server.handle_batch([b'FOG REVEAL 0 0 -1',
+                                              b'FOG REVEAL 0 0 1000000',
+                                              b'FOG REVEAL 5 3 10'])
+        replies = asyncio.run(bad_radii())
+        self.assertTrue(replies[0].startswith(b'ERR Invalid radius'))
+        self.assertTrue(replies[1].startswith(b'ERR Radius is larger'))
+        self.assertEqual(replies[2], b'OK\n')
+        self.assertEqual(board.mask('cave.png').count(), 10 * 7)
+    
+    def test_map_errors(self):
+        board = self.board
+        board.library.info.side_effect = MapError("Could not read cave.png")
+        listener = MusicListener(engine=AudioEngine(instance=FakeInstance()), fog=board)
+        # Shouldn't take down the numberpad listener
+        with self.assertLogs('dragonpi.dndmusic', level='ERROR'):
+            board.active_map = 'cave.png'
+            listener.fog_action('FogReveal')
+        ran = []
+        async def run_steps(steps):
+            ran.append(steps)
+        server = ControlServer(listener, run_steps)
+        async def scenario():
+            return await server.handle_batch([b'MAP cave.png'])
+        with self.assertLogs('dragonpi.control', level='ERROR'):
+            replies = asyncio.run(scenario())
+        self.assertTrue(replies[0].startswith(b'ERR Could not read'))
+        # Maps are shown without going through the audio engine
+        self.assertEqual(ran, [])
@@ -0,0 +1,89 @@
+# This file is part of DragonPi.
+# 
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import tempfile
+from unittest import mock, TestCase
+
+from pynput import keyboard
+
+from dragonpi.keymap import parse_key, key_to_spec, load_keymap, KeymapError
+from dragonpi.audio import AudioEngine
+from dragonpi.dndmusic import MusicListener
+
+
+class TestKeymap(TestCase):
+    def test_parse_key(self):
+        self.assertEqual(parse_key('1'), keyboard.KeyCode.from_char('1'))
+        self.assertEqual(parse_key('<vk:65437>'), keyboard.KeyCode.from_vk(65437))
+        with self.assertRaises(KeymapError):
+            parse_key('12')
+        # Check that converting back gives the same spec
+        for spec in ['1', '+', '<vk:65437>']:
+            self.assertEqual(key_to_spec(parse_key(spec)), spec)
+    
+    def test_load_keymap(self):
+        toml = ('[[key]]\n'
+                'key = "1"\n'
+                'action = "battle_music_1.mp3"\n'
+                'volume = 100\n'
+                'fade_time = 0.3\n'
+                '[[key]]\n'
+                'key = "-"\n'
+                'action = "VolDown"\n')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'keymap.toml')
+            with open(filename, mode='w') as fp:
+                fp.write(toml)
+            assignments = load_keymap(filename)
+        self.assertEqual(assignments, {
+            keyboard.KeyCode.from_char('1'): ('battle_music_1.mp3', 100, 0.3),
+            keyboard.KeyCode.from_char('-'): ('VolDown', None, None),
+        })
+    
+    def test_bad_keymap(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'keymap.json')
+            with open(filename, mode='w') as fp:
+                fp.write('{"key": [{"action": "Stop"}]}')
+            with self.assertRaises(KeymapError):
+                load_keymap(filename)
+
+
+@mock.patch('dragonpi.audio.vlc')
+class TestMusicListenerDispatch(TestCase):
+    @mock.patch.object(AudioEngine, 'play_song_steps')
+    @mock.patch.object(AudioEngine, 'change_volume_steps')
+    def test_swap_assignments(self, change_volume, play_song, vlc):
+        listener = MusicListener()
+        key = keyboard.KeyCode.from_char('-')
+        listener.on_press(key)
+        change_volume.assert_called_once_with(-10)
+        # Install a new keymap and check the key does something else
+        listener.set_key_assignments({key: ('goblins_1.opus', 50, 1.0)})
+        listener.on_press(key)
+        change_volume.assert_called_once()
+        play_song.assert_called_once()
+        self.assertEqual(play_song.call_args[0][1:], (50, 1.0))
+        # The VLC instance should not be recreated
+        vlc.Instance.assert_called_once()
+    
+    def test_touch_idle(self, vlc):
+        idle = mock.MagicMock()
+        listener = MusicListener(engine=AudioEngine(idle=idle))
+        # Any key counts as activity, even unassigned ones
+        listener.on_press(keyboard.KeyCode.from_char('q'))
+        idle.touch.assert_called_once()
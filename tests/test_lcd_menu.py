@@ -16,7 +16,9 @@
 
 from unittest import mock, TestCase
 
-from dragonpi.lcdmenu import LCDMenu, MenuItem
+from dragonpi.lcdmenu import (LCDMenu, MenuItem, AudioOutput, MenuGroup, PagedEntries,
+                              CHECKMARK)
+from dragonpi.trace import tracer
 
 
 class TestLCDMenu(TestCase):
@@ -67,3 +69,101 @@ class TestLCDMenu(TestCase):
         menu.refresh_text()
         lcd.clear.assert_called()
         lcd.message.assert_called_with('Item 1\nOption 1')
+    
+    def test_poll_trace(self):
+        lcd = mock.MagicMock()
+        lcd.is_pressed.return_value = False
+        menu = LCDMenu(lcd=lcd)
+        menu.add_entries(mock.MagicMock())
+        tracer.clear()
+        tracer.enabled = True
+        try:
+            for i in range(10):
+                menu.poll()
+            # Fast scans are left out of the trace
+            self.assertEqual(tracer.events(), [])
+            menu.slow_poll_time = -1
+            menu.poll()
+            self.assertEqual([e[2] for e in tracer.events()], ['lcd.poll'])
+        finally:
+            tracer.enabled = False
+            tracer.clear()
+    
+    def test_audio_output(self):
+        engine = mock.MagicMock()
+        engine.output_idx = 0
+        item = AudioOutput(engine)
+        self.assertEqual(item.active_text(), f'{CHECKMARK} 0:Auto')
+        item.move_right()
+        item.move_right()
+        self.assertEqual(item.active_text(), '  2:HDMI')
+        item.select()
+        engine.set_output.assert_called_once_with(2)
+    
+    def test_submenu(self):
+        lcd = mock.MagicMock()
+        menu = LCDMenu(lcd=lcd)
+        item1 = mock.MagicMock()
+        subitem = mock.MagicMock()
+        subitem.move_left.side_effect = NotImplementedError()
+        factory = mock.MagicMock(return_value=[subitem])
+        submenu = MenuGroup("Audio", factory)
+        menu.add_entries(item1, submenu)
+        # The submenu's entries should not be built until it is entered
+        menu.down_pressed()
+        factory.assert_not_called()
+        menu.select_pressed()
+        factory.assert_called_once()
+        self.assertIs(menu.active_item(), subitem)
+        # Left button goes back up
+        menu.left_pressed()
+        self.assertIs(menu.active_item(), submenu)
+        # Entering again re-uses the cached entries
+        menu.select_pressed()
+        factory.assert_called_once()
+    
+    def test_submenu_back(self):
+        menu = LCDMenu(lcd=mock.MagicMock())
+        engine = mock.MagicMock()
+        engine.output_idx = 0
+        submenu = MenuGroup("Audio", lambda: [AudioOutput(engine)])
+        menu.add_entries(submenu)
+        menu.select_pressed()
+        # The item uses the left button, so it doesn't leave the submenu
+        menu.left_pressed()
+        self.assertIsInstance(menu.active_item(), AudioOutput)
+        # Up wraps around to the "Back" entry
+        menu.up_pressed()
+        self.assertEqual(menu.active_item().name, "Back")
+        menu.select_pressed()
+        self.assertIs(menu.active_item(), submenu)
+    
+    def test_evict_submenus(self):
+        menu = LCDMenu(lcd=mock.MagicMock())
+        menu.max_cached_submenus = 1
+        submenus = [MenuGroup(f"Menu {i}", lambda: [mock.MagicMock()]) for i in range(2)]
+        menu.add_entries(*submenus)
+        menu.enter(submenus[0])
+        menu.back()
+        menu.enter(submenus[1])
+        self.assertIs(submenus[0].cached_entries, None)
+        self.assertIsNot(submenus[1].cached_entries, None)
+    
+    def test_paged_entries(self):
+        make_page = mock.MagicMock(side_effect=lambda start, stop: list(range(start, stop)))
+        entries = PagedEntries(1000, make_page, page_size=10, max_pages=2)
+        self.assertEqual(len(entries), 1000)
+        self.assertEqual(entries[15], 15)
+        self.assertEqual(entries[-1], 999)
+        make_page.assert_called_with(990, 1000)
+        # Pages in the cache don't get rebuilt
+        self.assertEqual(entries[19], 19)
+        self.assertEqual(make_page.call_count, 2)
+        # Least recently used pages get dropped
+        entries[500]
+        entries[15]
+        self.assertEqual(make_page.call_count, 3)
+        entries[990]
+        self.assertEqual(make_page.call_count, 4)
+        with self.assertRaises(IndexError):
+            entries[1000]
@@ -0,0 +1,94 @@
+# This file is part of DragonPi.
+# 
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from unittest import TestCase
+
+from dragonpi.lcdtiming import HybridTimer, SettleDeadline
+
+
+class FakeClock():
+    """Each reading of the clock takes *tick_ns*, and sleeping
+    overshoots by *oversleep_ns*."""
+    def __init__(self, tick_ns=1000, oversleep_ns=0):
+        self.now = 0
+        self.tick_ns = tick_ns
+        self.oversleep_ns = oversleep_ns
+        self.reads = 0
+        self.sleeps = []
+    
+    def clock(self):
+        self.now += self.tick_ns
+        self.reads += 1
+        return self.now
+    
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += int(seconds * 1e9) + self.oversleep_ns
+
+
+class TestHybridTimer(TestCase):
+    def test_long_delay(self):
+        clock = FakeClock()
+        timer = HybridTimer(clock=clock.clock, sleep=clock.sleep)
+        timer.delay_us(3000)
+        # Slept for all but the last 100 us, then spun for the rest
+        self.assertEqual(len(clock.sleeps), 1)
+        self.assertAlmostEqual(clock.sleeps[0], 0.0029, places=5)
+        self.assertGreaterEqual(clock.now, 3_000_000)
+        self.assertLess(clock.now, 3_002_000)
+        self.assertLessEqual(clock.reads, 105)
+    
+    def test_short_delay(self):
+        clock = FakeClock()
+        timer = HybridTimer(clock=clock.clock, sleep=clock.sleep)
+        timer.delay_us(50)
+        self.assertEqual(clock.sleeps, [])
+        self.assertGreaterEqual(clock.now, 50_000)
+    
+    def test_oversleep(self):
+        # A late wake-up still never returns early, and doesn't spin
+        clock = FakeClock(oversleep_ns=150_000)
+        timer = HybridTimer(clock=clock.clock, sleep=clock.sleep)
+        timer.wait_until(1_000_000)
+        self.assertGreaterEqual(clock.now, 1_000_000)
+        self.assertEqual(clock.reads, 2)
+
+
+class TestSettleDeadline(TestCase):
+    def test_batched_writes(self):
+        clock = FakeClock()
+        settle = SettleDeadline(HybridTimer(clock=clock.clock, sleep=clock.sleep))
+        # Bytes that take longer to set up than to settle never wait
+        for i in range(32):
+            clock.now += 200_000  # e.g. the I2C transfers
+            settle.wait()
+            settle.extend(100)
+        self.assertEqual(clock.sleeps, [])
+        elapsed = clock.now
+        self.assertLess(elapsed, 32 * 210_000)
+        # A clear takes a while, the next byte waits for it
+        settle.extend(3000)
+        start = clock.now
+        settle.wait()
+        self.assertGreaterEqual(clock.now - start, 2_990_000)
+        self.assertEqual(len(clock.sleeps), 1)
+    
+    def test_keeps_later_deadline(self):
+        clock = FakeClock()
+        settle = SettleDeadline(HybridTimer(clock=clock.clock, sleep=clock.sleep))
+        settle.extend(3000)
+        settle.extend(100)
+        self.assertGreaterEqual(settle.ready_ns, 3_000_000)
@@ -0,0 +1,197 @@
+# This file is part of DragonPi.
+# 
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import json
+import os
+import tempfile
+import threading
+from http.client import HTTPConnection
+from unittest import TestCase, mock, skipIf
+
+from dragonpi.maps import tiles
+from dragonpi.maps.server import MapServer, TileCache
+from dragonpi.maps.tiles import MapLibrary, MapError, map_digest, num_levels
+
+
+class TilesTestCase(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.maps_dir = os.path.join(self.tmpdir.name, 'maps')
+        self.cache_dir = os.path.join(self.tmpdir.name, 'tiles')
+        os.makedirs(self.maps_dir)
+        self.library = MapLibrary(maps_dir=self.maps_dir, cache_dir=self.cache_dir)
+    
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    
+    def fake_pyramid(self, name):
+        """Save a map and a pre-sliced, one-tile pyramid for it."""
+        image_file = os.path.join(self.maps_dir, name)
+        with open(image_file, mode='wb') as fp:
+            fp.write(b'not really an image')
+        digest = map_digest(image_file)
+        tile_dir = os.path.join(self.cache_dir, digest)
+        os.makedirs(os.path.join(tile_dir, '0'))
+        with open(os.path.join(tile_dir, '0', '0_0.jpg'), mode='wb') as fp:
+            fp.write(b'tile data')
+        info = dict(name=name, digest=digest, width=100, height=50,
+                    tile_size=256, levels=1)
+        with open(os.path.join(tile_dir, 'info.json'), mode='w') as fp:
+            json.dump(info, fp)
+        return info
+
+
+class TestMapLibrary(TilesTestCase):
+    def test_num_levels(self):
+        self.assertEqual(num_levels(256, 100), 1)
+        self.assertEqual(num_levels(257, 100), 2)
+        self.assertEqual(num_levels(100, 1024), 3)
+        self.assertEqual(num_levels(1025, 100), 4)
+    
+    def test_info(self):
+        info = self.fake_pyramid('cave.png')
+        # A stale pyramid for a map that has since changed
+        os.makedirs(os.path.join(self.cache_dir, '0123456789abcdef'))
+        self.assertEqual(self.library.names(), ['cave.png'])
+        self.assertEqual(self.library.info('cave.png'), info)
+        with self.assertRaises(MapError):
+            self.library.info('../cave.png')
+        self.library.prepare()
+        self.assertEqual(os.listdir(self.cache_dir), [info['digest']])
+    
+    def test_prepare_while_slicing(self):
+        info = self.fake_pyramid('cave.png')
+        digest = '0123456789abcdef'
+        tmp_dir = os.path.join(self.cache_dir, f'{digest}.tmp')
+        # Pretend another thread is slicing a new map
+        with self.library._build_lock:
+            os.makedirs(tmp_dir)
+            thread = threading.Thread(target=self.library.prepare)
+            thread.start()
+            thread.join(0.1)
+            self.assertTrue(os.path.exists(tmp_dir))
+            os.rename(tmp_dir, os.path.join(self.cache_dir, digest))
+            self.library._infos[digest] = dict(info, digest=digest)
+        thread.join()
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), sorted([info['digest'], digest]))
+    
+    @skipIf(tiles.Image is None, "Pillow is not installed")
+    def test_build_pyramid(self):
+        tiles.Image.new('RGB', (600, 300), 'red').save(
+            os.path.join(self.maps_dir, 'forest.png'))
+        info = self.library.info('forest.png')
+        self.assertEqual(info['levels'], 3)
+        tile_dir = os.path.join(self.cache_dir, info['digest'])
+        self.assertEqual(sorted(os.listdir(os.path.join(tile_dir, '2'))),
+                         ['0_0.jpg', '0_1.jpg', '1_0.jpg', '1_1.jpg', '2_0.jpg', '2_1.jpg'])
+        self.assertEqual(os.listdir(os.path.join(tile_dir, '0')), ['0_0.jpg'])
+        with tiles.Image.open(os.path.join(tile_dir, '2', '2_1.jpg')) as tile:
+            self.assertEqual(tile.size, (88, 44))
+    
+    @skipIf(tiles.Image is None, "Pillow is not installed")
+    def test_huge_map(self):
+        tiles.Image.new('RGB', (600, 300), 'red').save(
+            os.path.join(self.maps_dir, 'forest.png'))
+        self.fake_pyramid('cave.png')
+        stale_dir = os.path.join(self.cache_dir, '0123456789abcdef')
+        os.makedirs(stale_dir)
+        # Too big for Pillow, but the other maps still get prepared
+        with mock.patch.object(tiles.Image, 'MAX_IMAGE_PIXELS', 1000):
+            with self.assertRaises(MapError):
+                self.library.info('forest.png')
+            with self.assertLogs('dragonpi.maps.tiles', level='WARNING'):
+                self.library.prepare()
+        self.assertEqual(self.library.info('cave.png')['name'], 'cave.png')
+        self.assertFalse(os.path.exists(stale_dir))
+        digest = map_digest(os.path.join(self.maps_dir, 'forest.png'))
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, digest)))
+
+
+class TestMapServer(TilesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = MapServer(('127.0.0.1', 0), library=self.library,
+                                tiles=TileCache(max_open=1))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+    
+    def get(self, path, headers={}):
+        conn = HTTPConnection(*self.server.server_address)
+        conn.request('GET', path, headers=headers)
+        response = conn.getresponse()
+        body = response.read()
+        conn.close()
+        return response, body
+    
+    def test_tiles(self):
+        info = self.fake_pyramid('cave.png')
+        response, body = self.get('/maps')
+        self.assertEqual(json.loads(body), ['cave.png'])
+        response, body = self.get('/maps/cave.png')
+        self.assertEqual(json.loads(body), info)
+        # Fetch a tile
+        path = f"/tiles/{info['digest']}/0/0_0.jpg"
+        response, body = self.get(path)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, b'tile data')
+        self.assertIn('immutable', response.getheader('Cache-Control'))
+        etag = response.getheader('ETag')
+        # The browser already has it
+        response, body = self.get(path, headers={'If-None-Match': etag})
+        self.assertEqual(response.status, 304)
+        self.assertEqual(body, b'')
+        # Missing tiles and maps
+        response, body = self.get(f"/tiles/{info['digest']}/0/1_0.jpg")
+        self.assertEqual(response.status, 404)
+        response, body = self.get('/maps/dungeon.png')
+        self.assertEqual(response.status, 404)
+    
+    @skipIf(tiles.Image is None, "Pillow is not installed")
+    def test_empty_tile(self):
+        tiles.Image.new('RGB', (100, 50), 'red').save(os.path.join(self.maps_dir, 'cave.png'))
+        info = self.library.info('cave.png')
+        # Truncated by a power cut
+        tile_file = self.library.tile_path(info['digest'], 0, 0, 0)
+        open(tile_file, mode='wb').close()
+        response, body = self.get(f"/tiles/{info['digest']}/0/0_0.jpg")
+        self.assertEqual(response.status, 200)
+        self.assertGreater(len(body), 0)
+        self.assertGreater(os.path.getsize(tile_file), 0)
+    
+    def test_events(self):
+        self.fake_pyramid('cave.png')
+        fog = self.server.fog
+        fog.show('cave.png')
+        conn = HTTPConnection(*self.server.server_address, timeout=5)
+        conn.request('GET', '/events')
+        response = conn.getresponse()
+        self.assertEqual(response.getheader('Content-Type'), 'text/event-stream')
+        def next_event():
+            lines = []
+            while (line := response.readline().decode('utf8').strip()):
+                lines.append(line)
+            return lines[0][len('event: '):], json.loads(lines[1][len('data: '):])
+        self.assertEqual([next_event()[0] for i in range(3)], ['map', 'fog', 'cursor'])
+        # Only the changed cells are pushed
+        fog.update(0, 0, radius=0)
+        name, data = next_event()
+        self.assertEqual(name, 'fog')
+        self.assertEqual((data['x'], data['y'], data['w'], data['h']), (0, 0, 1, 1))
+        conn.close()
@@ -0,0 +1,61 @@
+# This file is part of DragonPi.
+# 
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import tempfile
+from unittest import mock, TestCase
+
+from pynput import keyboard
+
+from dragonpi.recording import EventRecorder, read_recording, KEY, BUTTON
+from dragonpi.replay import replay
+
+
+class TestRecording(TestCase):
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'session.dprec')
+            with EventRecorder(filename) as recorder:
+                recorder.record_key(keyboard.KeyCode.from_char('1'))
+                recorder.record_button(3)
+                recorder.record_key(keyboard.KeyCode.from_vk(65437))
+            events = list(read_recording(filename))
+        self.assertEqual([e[1:] for e in events],
+                         [(KEY, '1'), (BUTTON, 3), (KEY, '<vk:65437>')])
+        # Timestamps should be in order
+        timestamps = [e[0] for e in events]
+        self.assertEqual(timestamps, sorted(timestamps))
+    
+    def test_record_after_close(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'session.dprec')
+            recorder = EventRecorder(filename)
+            recorder.record_button(1)
+            recorder.close()
+            # Late events while shutting down are dropped
+            recorder.record_button(2)
+            events = list(read_recording(filename))
+        self.assertEqual([e[1:] for e in events], [(BUTTON, 1)])
+    
+    def test_replay(self):
+        music = mock.MagicMock()
+        menu = mock.MagicMock()
+        events = [(0, KEY, '1'), (1000, BUTTON, 2), (2000, KEY, '+')]
+        latencies = replay(events, music=music, menu=menu, speed=0)
+        self.assertEqual(len(latencies[KEY]), 2)
+        self.assertEqual(len(latencies[BUTTON]), 1)
+        music.on_press.assert_called_with(keyboard.KeyCode.from_char('+'))
+        menu.press.assert_called_once_with(2)
@@ -0,0 +1,90 @@
+# This file is part of DragonPi.
+# 
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import tempfile
+import threading
+from unittest import TestCase, skipUnless
+
+from dragonpi.audio import AudioEngine
+from dragonpi.fakevlc import FakeInstance
+from dragonpi.resources import (ResourceLedger, ResourceMonitor, read_rss,
+                                read_thread_cpu, STATM_FILE)
+from dragonpi.soak import soak, find_leaks
+
+
+class TestResourceLedger(TestCase):
+    def test_limits(self):
+        ledger = ResourceLedger(limits={'player': 1})
+        ledger.acquire('player')
+        with self.assertLogs('dragonpi.resources', level='WARNING'):
+            ledger.acquire('player')
+        self.assertEqual(ledger.counts(), {'player': 2})
+        ledger.release('player')
+        ledger.release('player')
+        self.assertEqual(ledger.counts(), {'player': 0})
+        self.assertEqual(ledger.total['player'], 2)
+
+
+class TestEngineResources(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.song_files = []
+        for idx in range(12):
+            song_file = os.path.join(self.tmpdir.name, f'song_{idx}.mp3')
+            open(song_file, mode='w').close()
+            self.song_files.append(song_file)
+        self.engine = AudioEngine(instance=FakeInstance())
+    
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    
+    def test_stop_releases_player(self):
+        engine = self.engine
+        engine.play_song(self.song_files[0], 100, 0)
+        player = engine._player
+        engine.stop_music(fade_time=0)
+        self.assertTrue(player.released)
+        self.assertEqual(engine.resources.counts()['player'], 0)
+        engine.close()
+        self.assertEqual(dict(engine.instance.live), {'player': 0, 'media': 0})
+    
+    def test_soak(self):
+        samples = soak(self.engine, self.song_files, 2000, report_every=500)
+        self.assertEqual(len(samples), 4)
+        self.assertEqual(find_leaks(samples, self.engine), [])
+        # The counts stay flat
+        for sample in samples:
+            self.assertLessEqual(sample['live']['player'], 1)
+            self.assertEqual(sample['live']['media'], self.engine.media_cache_size)
+
+
+@skipUnless(os.path.exists(STATM_FILE), "Needs /proc")
+class TestResourceMonitor(TestCase):
+    def test_sample(self):
+        self.assertGreater(read_rss(), 0)
+        self.assertIn(threading.get_native_id(), read_thread_cpu())
+        ledger = ResourceLedger()
+        ledger.acquire('media')
+        monitor = ResourceMonitor(ledger, rss_limit=1024)
+        with self.assertLogs('dragonpi.resources', level='WARNING'):
+            sample = monitor.sample()
+        self.assertEqual(sample['counts'], {'media': 1})
+        self.assertEqual(sample['cpu'], {})
+        # CPU use is measured between samples
+        sum(range(100000))
+        sample = monitor.sample()
+        self.assertIn(threading.current_thread().name, sample['cpu'])
@@ -0,0 +1,126 @@
+# This file is part of DragonPi.
+# 
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import asyncio
+import os
+import tempfile
+import threading
+from unittest import mock, TestCase
+
+from pynput import keyboard
+
+from dragonpi.audio import AudioEngine
+from dragonpi.fakevlc import FakeInstance
+from dragonpi.idle import IdleManager
+from dragonpi.lcdmenu import Volume
+from dragonpi.runtime import AsyncRuntime
+
+
+class TestAsyncRuntime(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.song_file = os.path.join(self.tmpdir.name, 'tavern.mp3')
+        open(self.song_file, mode='w').close()
+        self.engine = AudioEngine(instance=FakeInstance())
+        lcd = mock.MagicMock()
+        lcd.is_pressed.return_value = False
+        self.runtime = AsyncRuntime(self.engine, lambda engine: [Volume(engine)], lcd=lcd)
+    
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        self.runtime.io_executor.shutdown()
+    
+    def test_keys_and_buttons(self):
+        runtime = self.runtime
+        key = keyboard.KeyCode.from_char('1')
+        runtime.listener.set_key_assignments({key: (self.song_file, 100, 0.01)})
+        async def scenario():
+            runtime.loop = asyncio.get_running_loop()
+            runtime.keys = asyncio.Queue()
+            runtime._audio_lock = asyncio.Lock()
+            reader = asyncio.create_task(runtime.read_keys())
+            # Press a key on the numberpad
+            runtime.listener.handle_key(key)
+            await asyncio.sleep(0.1)
+            self.assertEqual(self.engine.song_file, self.song_file)
+            self.assertEqual(self.engine._player.volume, 100)
+            # Turn down the volume from the LCD menu
+            await runtime.run_io(runtime.menu.left_pressed)
+            self.assertEqual(self.engine.volume, 90)
+            self.assertEqual(self.engine._player.volume, 90)
+            reader.cancel()
+        asyncio.run(scenario())
+    
+    def test_steps_in_order(self):
+        runtime = self.runtime
+        events = []
+        def steps(name):
+            events.append(f'{name} start')
+            yield 0.01
+            events.append(f'{name} end')
+        async def scenario():
+            runtime._audio_lock = asyncio.Lock()
+            await asyncio.gather(runtime.run_steps(steps('a')),
+                                 runtime.run_steps(steps('b')))
+        asyncio.run(scenario())
+        self.assertEqual(events, ['a start', 'a end', 'b start', 'b end'])
+    
+    def test_idle_on_loop(self):
+        idle = IdleManager(timeout=0.02)
+        engine = AudioEngine(instance=FakeInstance(), idle=idle)
+        lcd = mock.MagicMock()
+        lcd.is_pressed.return_value = False
+        runtime = AsyncRuntime(engine, lambda engine: [], idle=idle, lcd=lcd)
+        async def scenario():
+            runtime.loop = asyncio.get_running_loop()
+            runtime._audio_lock = asyncio.Lock()
+            idle.use_loop(runtime.loop)
+            threads = threading.active_count()
+            await runtime.run_steps(engine.play_song_steps(self.song_file, 100, 0.01))
+            await runtime.run_steps(engine.toggle_pause_steps())
+            # Going idle in the middle of a fade waits for the fade
+            fade = asyncio.create_task(
+                runtime.run_steps(engine.fade_volume_steps(50, fade_time=0.1)))
+            await asyncio.sleep(0.05)
+            self.assertTrue(idle.is_idle)
+            self.assertIsNot(engine._player, None)
+            await fade
+            await asyncio.sleep(0.01)
+            self.assertIs(engine._player, None)
+            # The countdowns didn't need any threads
+            self.assertEqual(threading.active_count(), threads)
+            idle.cancel()
+        try:
+            asyncio.run(scenario())
+        finally:
+            runtime.io_executor.shutdown()
+    
+    def test_check_resources(self):
+        runtime = self.runtime
+        monitor = mock.MagicMock()
+        monitor.interval = 0.01
+        threads = []
+        monitor.sample.side_effect = lambda: threads.append(threading.current_thread())
+        runtime.resource_monitor = monitor
+        async def scenario():
+            runtime.loop = asyncio.get_running_loop()
+            task = asyncio.create_task(runtime.check_resources())
+            await asyncio.sleep(0.05)
+            task.cancel()
+        asyncio.run(scenario())
+        # /proc is read on the I/O thread, not the event loop
+        self.assertGreater(len(threads), 0)
+        self.assertNotIn(threading.main_thread(), threads)
@@ -0,0 +1,108 @@
+# This file is part of DragonPi.
+# 
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import tempfile
+from unittest import mock, TestCase
+
+from dragonpi.audio import AudioEngine
+from dragonpi.fakevlc import FakeInstance
+from dragonpi.snapshot import SnapshotWriter, read_snapshot, write_snapshot
+
+
+class TestSnapshot(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.song_file = os.path.join(self.tmpdir.name, 'tavern.mp3')
+        open(self.song_file, mode='w').close()
+        self.snapshot_file = os.path.join(self.tmpdir.name, 'state', 'snapshot.json')
+    
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    
+    def test_save_on_change(self):
+        engine = AudioEngine(instance=FakeInstance())
+        writer = SnapshotWriter(engine, filename=self.snapshot_file,
+                                position_interval=3600)
+        self.assertIs(read_snapshot(self.snapshot_file), None)
+        self.assertTrue(writer.save())
+        # Nothing changed, so nothing to write
+        self.assertFalse(writer.save())
+        # Start a song
+        engine.play_song(self.song_file, 100, fade_time=0.01)
+        engine._player.set_time(5000)
+        self.assertTrue(writer.save())
+        state = read_snapshot(self.snapshot_file)
+        self.assertEqual(state['song_file'], self.song_file)
+        self.assertGreaterEqual(state['position'], 5000)
+        # Only the position changed, so don't write again yet
+        engine._player.set_time(9000)
+        self.assertFalse(writer.save())
+        # Pausing is a real change
+        engine.toggle_pause()
+        self.assertTrue(writer.save())
+        self.assertTrue(read_snapshot(self.snapshot_file)['paused'])
+    
+    def test_restore(self):
+        state = {'song_file': self.song_file, 'position': 12000,
+                 'volume': 70, 'paused': False, 'output_idx': 0}
+        engine = AudioEngine(instance=FakeInstance())
+        engine.restore(state, fade_time=0.01)
+        self.assertEqual(engine._player.volume, 70)
+        self.assertGreaterEqual(engine._player.get_time(), 12000)
+        # A paused song should wait for the pause key
+        engine = AudioEngine(instance=FakeInstance())
+        engine.restore(dict(state, paused=True), fade_time=0.01)
+        self.assertIs(engine._player, None)
+        engine.toggle_pause()
+        self.assertGreaterEqual(engine._player.get_time(), 12000)
+    
+    def test_sync_directory(self):
+        with mock.patch('os.fsync', wraps=os.fsync) as fsync:
+            write_snapshot(self.snapshot_file, {'volume': 50})
+        # Once for the file, once for the directory holding it
+        self.assertEqual(fsync.call_count, 2)
+        self.assertEqual(read_snapshot(self.snapshot_file), {'volume': 50})
+    
+    def test_corrupt_snapshot(self):
+        os.makedirs(os.path.dirname(self.snapshot_file))
+        with open(self.snapshot_file, mode='w') as fp:
+            fp.write('{"song_fi')
+        self.assertIs(read_snapshot(self.snapshot_file), None)
+        # Valid JSON that isn't a snapshot
+        with open(self.snapshot_file, mode='w') as fp:
+            fp.write('[1, 2, 3]')
+        with self.assertLogs('dragonpi.snapshot', level='WARNING'):
+            self.assertIs(read_snapshot(self.snapshot_file), None)
+    
+    def test_restore_invalid(self):
+        state = {'song_file': self.song_file, 'position': -5,
+                 'volume': float('nan'), 'paused': False, 'output_idx': 5}
+        engine = AudioEngine(instance=FakeInstance())
+        with self.assertLogs('dragonpi.audio', level='WARNING'):
+            engine.restore(state, fade_time=0.01)
+        # The bad fields are ignored, and the song still plays
+        self.assertEqual(engine.output_idx, 0)
+        self.assertEqual(engine.volume, 100)
+        self.assertEqual(engine.song_file, self.song_file)
+        engine.play_song(self.song_file, 100, fade_time=0.01)
+        self.assertEqual(engine.snapshot()['output_idx'], 0)
+        # A song file that isn't a string is dropped
+        engine = AudioEngine(instance=FakeInstance())
+        with self.assertLogs('dragonpi.audio', level='WARNING'):
+            engine.restore({'song_file': 12, 'volume': 150}, fade_time=0.01)
+        self.assertIs(engine._player, None)
+        self.assertEqual(engine.volume, 100)
@@ -0,0 +1,53 @@
+# This file is part of DragonPi.
+# 
+# DragonPi is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# DragonPi is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with DragonPi.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import json
+from unittest import TestCase
+
+from dragonpi.trace import Tracer
+
+
+class TestTracer(TestCase):
+    def test_disabled(self):
+        tracer = Tracer(capacity=4)
+        tracer.instant('key')
+        with tracer.span('fade'):
+            pass
+        self.assertEqual(tracer.events(), [])
+    
+    def test_ring_buffer(self):
+        tracer = Tracer(capacity=4)
+        tracer.enabled = True
+        for i in range(6):
+            tracer.instant('key', {'i': i})
+        # Only the last four events are kept, oldest first
+        events = tracer.events()
+        self.assertEqual([e[5]['i'] for e in events], [2, 3, 4, 5])
+    
+    def test_chrome_trace(self):
+        tracer = Tracer(capacity=8)
+        tracer.enabled = True
+        with tracer.span('fade', target=50):
+            tracer.instant('write8', {'value': 0x33})
+        trace = json.loads(json.dumps(tracer.chrome_trace()))
+        events = [e for e in trace['traceEvents'] if e['ph'] != 'M']
+        self.assertEqual([e['name'] for e in events], ['fade', 'write8'])
+        fade, write8 = events
+        self.assertEqual(fade['ph'], 'X')
+        self.assertEqual(fade['args'], {'target': '50'})
+        self.assertGreaterEqual(fade['dur'], 0)
+        self.assertEqual(write8['ph'], 'i')
+        self.assertGreaterEqual(write8['ts'], fade['ts'])